@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+
+import lz77
+import crc32
+import fnt4_extract
+from fnt4_extract import Font, FontHeader
+
+"""
+Benchmark of the FNT4 tools over the sample fonts,
+times header/table parsing, glyph decompression, export, lz77 round-trips and crc32,
+writes the results as json (seconds, MB/s, glyphs/s, peak memory) and can compare them against a stored baseline.
+
+python benchmark.py [font ...] [--output result.json] [--baseline baseline.json]
+"""
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sample')
+SAMPLE_FONTS = [
+    os.path.join(SAMPLE_DIR, 'wiki_file', 'font_00.fnt'),
+    os.path.join(SAMPLE_DIR, 'FNT4', 'PCSG00997_FNT4_v0.fnt'),
+]
+
+
+# trace peak memory of every case (one more run under tracemalloc, which is much slower)
+TRACE_MEMORY = True
+
+
+def measure(fn: Callable, repeat: int, nbytes: int=0, glyphs: int=0) -> Dict[str, float]:
+    """best time of repeat runs, and the peak memory traced in one more run"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    result = {'seconds': best}
+    if TRACE_MEMORY:
+        tracemalloc.start()
+        fn()
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    if nbytes:
+        result['mb_per_sec'] = nbytes / best / 1e6
+    if glyphs:
+        result['glyphs_per_sec'] = glyphs / best
+    return result
+
+
+def bench_font(path: str, repeat: int, roundtrip_glyphs: int) -> Dict[str, Dict[str, float]]:
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    font = Font.read(data)
+    glyph_ids = sorted(font.glyphs.keys())
+    glyphs = [font.glyphs[glyph_id] for glyph_id in glyph_ids]
+    seek_bits, backseek_nbyte = fnt4_extract.LZ77_PARAMS[font.version]
+    decompressed = [glyph.glyph_data.decompress(seek_bits, backseek_nbyte) for glyph in glyphs]
+    decompressed_size = sum(len(d) for d in decompressed)
+    table_size = 4 * len(font.characters)
+    table_bytes = data[0x10:0x10+table_size]
+
+    results = {}
+    results['header_parse'] = measure(lambda: FontHeader(data), repeat)
+    results['font_read'] = measure(lambda: Font.read(data), repeat, nbytes=table_size, glyphs=len(glyphs))
+    results['glyph_headers'] = measure(
+        lambda: fnt4_extract.read_glyph_headers(data, font.glyph_table.offset, font.version), repeat, glyphs=len(glyphs))
+    results['decompress'] = measure(
+        lambda: [glyph.glyph_data.decompress(seek_bits, backseek_nbyte) for glyph in glyphs],
+        repeat, nbytes=decompressed_size, glyphs=len(glyphs))
+    results['decode_level0'] = measure(
+        lambda: [glyph.decode_level0(font.version) for glyph in glyphs], repeat, glyphs=len(glyphs))
+    results['decompress_images'] = measure(
+        lambda: [glyph.decompress(font.version) for glyph in glyphs], repeat, glyphs=len(glyphs))
+    with tempfile.TemporaryDirectory() as output_path:
+        results['export'] = measure(
+            lambda: fnt4_extract.export_glyphs(path, output_path, workers=1, progress=False), 1, glyphs=len(glyphs))
+        results['export_atlas'] = measure(
+            lambda: fnt4_extract.export_atlas(font, output_path), 1, glyphs=len(glyphs))
+
+    samples = [d for d in decompressed if d][:roundtrip_glyphs]
+    sample_size = sum(len(d) for d in samples)
+    for level in lz77.CompressLevel:
+        compressed = []
+        def roundtrip():
+            compressed[:] = [lz77.compress(d, seek_bits, backseek_nbyte, level) for d in samples]
+            for d, c in zip(samples, compressed):
+                assert lz77.decompress(c, seek_bits, backseek_nbyte, len(d)) == d, 'lz77 round-trip error'
+        result = measure(roundtrip, 1, nbytes=sample_size, glyphs=len(samples))
+        result['ratio'] = sum(len(c) for c in compressed) / sample_size if sample_size else 0.0
+        results[f'lz77_roundtrip_{level.name.lower()}'] = result
+
+    results['crc32_table'] = measure(lambda: crc32.crc32(table_bytes, 0), repeat, nbytes=table_size)
+    results['crc32_font'] = measure(lambda: crc32.crc32(data, 0), repeat, nbytes=len(data))
+    return results
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """print speedup of every case against baseline, return the cases slower than threshold times"""
+    regressions = []
+    for font_name, cases in results['fonts'].items():
+        baseline_cases = baseline.get('fonts', {}).get(font_name, {})
+        for case, result in cases.items():
+            if case not in baseline_cases:
+                continue
+            speedup = baseline_cases[case]['seconds'] / result['seconds'] if result['seconds'] else float('inf')
+            mark = ''
+            if speedup * threshold < 1:
+                mark = '  REGRESSION'
+                regressions.append(f"{font_name}/{case}")
+            print(f"{font_name:>28} {case:>24}: {speedup:6.2f}x{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark FNT4 tools over sample fonts")
+    parser.add_argument('fonts', nargs='*', default=SAMPLE_FONTS, help="fnt(FNT4) files, default the sample fonts")
+    parser.add_argument('--output', help="write results json here")
+    parser.add_argument('--baseline', help="results json to compare with")
+    parser.add_argument('--threshold', type=float, default=1.2, help="a case is a regression if slower than baseline by this factor")
+    parser.add_argument('--repeat', type=int, default=3, help="runs of every fast case, the best time is kept")
+    parser.add_argument('--roundtrip-glyphs', type=int, default=500, help="glyphs used for lz77 round-trips")
+    parser.add_argument('--no-memory', action='store_true', help="skip tracing peak memory, much faster")
+    args = parser.parse_args()
+    global TRACE_MEMORY
+    TRACE_MEMORY = not args.no_memory
+
+    results = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'fonts': {},
+    }
+    for path in args.fonts:
+        name = os.path.basename(path)
+        print(f"benchmark {name}")
+        results['fonts'][name] = bench_font(path, args.repeat, args.roundtrip_glyphs)
+        for case, result in results['fonts'][name].items():
+            rates = ''.join(f", {result[key]:.1f} {unit}" for key, unit in
+                            (('mb_per_sec', 'MB/s'), ('glyphs_per_sec', 'glyphs/s')) if key in result)
+            peak = f", peak {result['peak_bytes']/1e6:.2f} MB" if 'peak_bytes' in result else ''
+            print(f"  {case:>24}: {result['seconds']*1000:10.3f} ms{rates}{peak}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
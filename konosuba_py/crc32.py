@@ -1,3 +1,7 @@
+import random
+import timeit
+import zlib
+
 CRC32_TABLE = [  # u32 * 256
     0x00000000, 0x77073096, 0xee0e612c, 0x990951ba, 0x076dc419, 0x706af48f, 0xe963a535, 0x9e6495a3,
     0x0edb8832, 0x79dcb8a4, 0xe0d5e91e, 0x97d2d988, 0x09b64c2b, 0x7eb17cbd, 0xe7b82d07, 0x90bf1d91,
@@ -33,8 +37,8 @@ CRC32_TABLE = [  # u32 * 256
     0xb3667a2e, 0xc4614ab8, 0x5d681b02, 0x2a6f2b94, 0xb40bbe37, 0xc30c8ea1, 0x5a05df1b, 0x2d02ef8d,
 ]
 
-def crc32(data: bytes, init: int) -> int:
-    """Compute the CRC32 checksum of the given data with an initial value."""
+def crc32_table(data: bytes, init: int) -> int:
+    """Compute the CRC32 checksum byte by byte with CRC32_TABLE, the reference of crc32()."""
     if data==b'':
         print("Warning!! crc32_fn might error")
     state = ~init & 0xFFFFFFFF
@@ -44,17 +48,72 @@ def crc32(data: bytes, init: int) -> int:
     state &= 0xFFFFFFFF
     return ~state & 0xFFFFFFFF
 
-def test_crc32(data: bytes, expected_value: int):
+def crc32(data: bytes, init: int) -> int:
+    """Compute the CRC32 checksum of the given data with an initial value.
+    CRC32_TABLE is the standard (reflected 0xEDB88320) crc32 table, so zlib.crc32 gives the same result."""
+    if data==b'':
+        print("Warning!! crc32_fn might error")
+    return zlib.crc32(data, init)
+
+class Crc32:
+    """Incremental CRC32, update() accepts any bytes-like object (bytes, bytearray, memoryview),
+    crc32(a+b, init) == Crc32(init=init).update(a).update(b).digest()"""
+    def __init__(self, data: bytes=b'', init: int=0) -> None:
+        self.value = init & 0xFFFFFFFF
+        if data: self.update(data)
+
+    def update(self, data: bytes) -> 'Crc32':
+        self.value = zlib.crc32(data, self.value)
+        return self
+
+    def digest(self) -> int:
+        return self.value
+
+def check_crc32(data: bytes, expected_value: int):
     result = crc32(data, 0)
     assert result == expected_value, f"Expected {expected_value}, but got {result}"
+    result = crc32_table(data, 0)
+    assert result == expected_value, f"Expected {expected_value}, but got {result}"
 
 def test_higurashi():
-    test_crc32("ひぐらしのなく頃に奉".encode('utf-8'), 0x286f1cb)
+    check_crc32("ひぐらしのなく頃に奉".encode('utf-8'), 0x286f1cb)
 
 def test_umineko():
-    test_crc32("うみねこのなく頃に咲".encode('utf-8'), 0x117b2a00)
+    check_crc32("うみねこのなく頃に咲".encode('utf-8'), 0x117b2a00)
+
+def test_same_as_table():
+    rand = random.Random(0)
+    for size in [1, 2, 3, 7, 8, 9, 255, 256, 4096]:
+        data = rand.randbytes(size)
+        init = rand.getrandbits(32)
+        assert crc32(data, init) == crc32_table(data, init), f"different result at size {size}"
+
+def test_incremental():
+    data = "ひぐらしのなく頃に奉".encode('utf-8')
+    view = memoryview(data)
+    crc = Crc32()
+    for i in range(0, len(view), 5):
+        crc.update(view[i:i+5])
+    assert crc.digest() == 0x286f1cb
+    assert Crc32(data[:7], init=0x1234).update(data[7:]).digest() == crc32(data, 0x1234)
+
+def benchmark(size: int=1<<20, repeat: int=3):
+    """time crc32_table against crc32 on the higurashi/umineko vectors and a larger random buffer"""
+    vectors = {
+        'higurashi': "ひぐらしのなく頃に奉".encode('utf-8'),
+        'umineko': "うみねこのなく頃に咲".encode('utf-8'),
+        f'{size>>10}KiB': random.Random(0).randbytes(size),
+    }
+    for name, data in vectors.items():
+        for fn, total in ((crc32_table, size >> 6), (crc32, size)):
+            loops = max(1, total // len(data))
+            best = min(timeit.repeat(lambda: fn(data, 0), number=loops, repeat=repeat))
+            print(f"{name:>10} {fn.__name__:>11}: {loops*len(data)/best/1e6:10.2f} MB/s")
 
 if __name__ == "__main__":
-    # test_higurashi()
-    # test_umineko()
+    test_higurashi()
+    test_umineko()
+    test_same_as_table()
+    test_incremental()
     print("test pass")
+    benchmark()
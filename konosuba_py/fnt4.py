@@ -0,0 +1,79 @@
+import sys
+import json
+import argparse
+
+import fnt4_metadata
+
+"""
+Command line of the FNT4 tools
+
+python fnt4.py info font.fnt [--json]
+python fnt4.py metadata font.fnt [-o metadata.txt]
+python fnt4.py extract font.fnt output_dir [--mip 0 1] [--range START END] [--workers N] [--atlas]
+
+info and metadata only read the character table and glyph headers (fnt4_metadata), numpy and PIL are never imported,
+extract imports fnt4_extract when it runs.
+"""
+
+
+def add_extract_arguments(parser: argparse.ArgumentParser):
+    # arguments of extract, also used by fnt4_extract.py
+    parser.add_argument('font_path', help="fnt(FNT4) file path")
+    parser.add_argument('output_path', help="glyph output path")
+    parser.add_argument('--mip', type=int, nargs='+', default=[0], choices=range(4),
+                        help="mip levels to save, default only the first mip level")
+    parser.add_argument('--range', type=lambda v: int(v, 0), nargs=2, metavar=('START', 'END'),
+                        help="export glyphs of character codes in [START, END)")
+    parser.add_argument('--workers', type=int, default=None, help="processes to export, default cpu count")
+    parser.add_argument('--atlas', action='store_true', help="pack glyphs of each mip level into sprite sheets instead of a png per glyph")
+
+
+def info(args):
+    summary = fnt4_metadata.font_info(args.font_path)
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+        return
+    for key, value in summary.items():
+        if isinstance(value, float):
+            value = f"{value:.4f}"
+        print(f"{key}: {value}")
+
+
+def metadata(args):
+    if args.output in (None, '-'):
+        fnt4_metadata.write_metadata(args.font_path, sys.stdout)
+        print()
+        return
+    with open(args.output, 'w') as f:
+        fnt4_metadata.write_metadata(args.font_path, f)
+
+
+def extract(args):
+    import fnt4_extract
+    fnt4_extract.extract(args.font_path, args.output_path, args.mip, args.range, args.workers, args.atlas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FNT4 font tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    info_parser = subparsers.add_parser('info', help="print header, characters/glyphs count and glyph data sizes")
+    info_parser.add_argument('font_path', help="fnt(FNT4) file path")
+    info_parser.add_argument('--json', action='store_true', help="print as json")
+    info_parser.set_defaults(func=info)
+
+    metadata_parser = subparsers.add_parser('metadata', help="write character mappings and glyph metrics (metadata.txt)")
+    metadata_parser.add_argument('font_path', help="fnt(FNT4) file path")
+    metadata_parser.add_argument('-o', '--output', help="output file, default stdout")
+    metadata_parser.set_defaults(func=metadata)
+
+    extract_parser = subparsers.add_parser('extract', help="write metadata.txt and glyph pngs (or atlas sheets)")
+    add_extract_arguments(extract_parser)
+    extract_parser.set_defaults(func=extract)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,27 @@
 import os
+import time
+import argparse
+import json
+import mmap
 import struct
 import math
+import hashlib
+import threading
+import queue
 from dataclasses import dataclass, field
 from enum import IntEnum, Enum
 from typing import Dict, List, Optional, Tuple
-from collections import defaultdict
+from collections import Counter, OrderedDict
+from collections.abc import MutableMapping
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import Image
-import io
 import numpy as np
 
 import lz77
 import crc32
-
-# debug result when 19968<=unicode<=40959
-LOG_ADW, LOG_OFS = [], []
-# LOG_ADW = [48]
-# LOG_OFS = [(-8, 32), (-8, 48), (-8, 56), (-16, 48), (-16, 56), (-8, 40)]
+from font_stats import FontStats
+from fnt4_metadata import CP932_SJIS, CP932_UNICODE, SJIS_CP932, UNICODE_CP932, map_sjis, write_metadata_lines
 
 """
 FNT Tool for Entergram game e.g. konosuba,9nine
@@ -27,8 +33,11 @@ https://github.com/DCNick3/shin-translation-tools/blob/master/shin-font/src/lib.
 https://github.com/YuriSizuku/GalgameReverse/blob/master/project/entergram/src/9nine_switch_fnt.py
 """
 
-# SJIS table
-CP932_SJIS = {}
+# lz77 params of glyph data, fnt_version: (seek_bits, backseek_nbyte)
+LZ77_PARAMS = {
+    1: (10, 2),
+    0: (3, 1),
+}
 
 # util functions
 class struct_t(struct.Struct):
@@ -102,6 +111,13 @@ class FontHeader(struct_t):
         assert self.magic == b"FNT4", f"Invalid magic number: {self.magic}"
         # assert self.version == 0x01
 
+    @staticmethod
+    def build(version, fsize, ascent, descent) -> bytes:
+        if version==1:
+            return struct.pack('<4s2I2H', b"FNT4", version, fsize, ascent, descent)
+        assert version==0, f"unknown fnt version:{version}"
+        return struct.pack('<4sI2HI', b"FNT4", fsize, ascent, descent, 0)
+
 
 class GlyphHeader(struct_t):
     '''terms are roughly based on https://freetype.org/freetype2/docs/glyphs/glyphs-3.html
@@ -120,13 +136,107 @@ class GlyphHeader(struct_t):
             super().__init__(data, cur, fmt='<2b6BH',names=[
                 'bearing_x', 'bearing_y', 'actual_width', 'actual_height', 'advance_width', 'unused', 'texture_width', 'texture_height', 'compressed_size'
                 ])
-            assert self.unused == 0
+            if data is not None: assert self.unused == 0
         else:
             assert fnt_version==0, f"TO_DEBUG:New version:{fnt_version} fnt appear!"
             super().__init__(data, cur, fmt='<2b4BH',names=[
                 'bearing_x', 'bearing_y', 'actual_width', 'actual_height', 'advance_width', 'unknow', 'compressed_size'
                 ])
-            assert self.unknow == 0
+            if data is not None: assert self.unknow == 0
+
+    @classmethod
+    def from_info(cls, info: 'GlyphInfo', compressed_size: int, fnt_version=1) -> 'GlyphHeader':
+        header = cls(None, fnt_version=fnt_version)
+        header.bearing_x = info.bearing_x
+        header.bearing_y = info.bearing_y
+        header.actual_width = info.actual_width
+        header.actual_height = info.actual_height
+        header.advance_width = info.advance_width
+        if fnt_version==1:
+            header.unused = 0
+            header.texture_width = info.texture_width
+            header.texture_height = info.texture_height
+        else:
+            header.unknow = 0
+        header.compressed_size = compressed_size
+        return header
+
+
+# numpy dtype of GlyphHeader for bulk decoding, fnt_version: dtype
+GLYPH_HEADER_DTYPES = {
+    1: np.dtype([('bearing_x', 'i1'), ('bearing_y', 'i1'), ('actual_width', 'u1'), ('actual_height', 'u1'),
+                 ('advance_width', 'u1'), ('unused', 'u1'), ('texture_width', 'u1'), ('texture_height', 'u1'),
+                 ('compressed_size', '<u2')]),
+    0: np.dtype([('bearing_x', 'i1'), ('bearing_y', 'i1'), ('actual_width', 'u1'), ('actual_height', 'u1'),
+                 ('advance_width', 'u1'), ('unknow', 'u1'), ('compressed_size', '<u2')]),
+}
+
+
+def read_glyph_headers(data: bytes, offsets: np.ndarray, fnt_version) -> np.ndarray:
+    """decode GlyphHeader at all offsets at once, return a structured array of GLYPH_HEADER_DTYPES"""
+    dtype = GLYPH_HEADER_DTYPES[fnt_version]
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    rows = buffer[np.asarray(offsets, dtype=np.intp)[:, None] + np.arange(dtype.itemsize)]  # gather [n, header size]
+    return rows.view(dtype).reshape(-1)
+
+
+class GlyphTable:
+    """
+    columnar glyph headers of a font, every column is a numpy array indexed by glyph_id:
+    offset: glyph offset in font data, character: the first character code use this glyph,
+    GlyphHeader fields (texture_width/texture_height are the actual size in FNT4 v0),
+    uncompressed_size, data_offset: start of compressed/uncompressed glyph data
+    """
+    def __init__(self, headers: np.ndarray, offsets: np.ndarray, characters: np.ndarray, fnt_version):
+        # headers: structured array of GLYPH_HEADER_DTYPES[fnt_version]
+        self.version = fnt_version
+        self.offset = np.asarray(offsets, dtype=np.uint32)
+        self.character = np.asarray(characters, dtype=np.uint32)
+        self.bearing_x = headers['bearing_x']
+        self.bearing_y = headers['bearing_y']
+        self.actual_width = headers['actual_width']
+        self.actual_height = headers['actual_height']
+        self.advance_width = headers['advance_width']
+        self.compressed_size = headers['compressed_size']
+        if fnt_version==1:
+            assert not headers['unused'].any()
+            self.texture_width = headers['texture_width']
+            self.texture_height = headers['texture_height']
+            initial_mip_size = self.texture_width.astype(np.uint32) * self.texture_height
+            self.uncompressed_size = initial_mip_size + (initial_mip_size//4) + (initial_mip_size//16) + (initial_mip_size//64)
+        else:
+            assert not headers['unknow'].any()
+            self.texture_width = self.actual_width
+            self.texture_height = self.actual_height
+            stride = (self.actual_width.astype(np.uint32) + 1) // 2
+            self.uncompressed_size = stride * self.actual_height
+        self.data_offset = self.offset + headers.dtype.itemsize
+
+    @classmethod
+    def read(cls, data: bytes, offsets: np.ndarray, characters: np.ndarray, fnt_version) -> 'GlyphTable':
+        return cls(read_glyph_headers(data, offsets, fnt_version), offsets, characters, fnt_version)
+
+    @classmethod
+    def from_header(cls, header, chara_index: int, fnt_version) -> 'GlyphTable':
+        # table of one glyph, header: any object has the GlyphHeader attributes
+        dtype = GLYPH_HEADER_DTYPES[fnt_version]
+        headers = np.array([tuple(getattr(header, name, 0) for name in dtype.names)], dtype=dtype)
+        return cls(headers, [0], [chara_index or 0], fnt_version)
+
+    def __len__(self) -> int:
+        return len(self.offset)
+
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in vars(self).values() if isinstance(column, np.ndarray))
+
+
+def _table_column(name: str, doc: str, fnt_version=None) -> property:
+    # property of GlyphInfo read from the GlyphTable column, only exists in fnt_version if given
+    def getter(self):
+        if fnt_version is not None and self._table.version != fnt_version:
+            raise AttributeError(f"{name} only in FNT4 v{fnt_version}")
+        return getattr(self._table, name)[self._index].item()
+    return property(getter, doc=doc)
 
 
 class GlyphInfo:  # inherits from GlyphHeader
@@ -137,25 +247,42 @@ class GlyphInfo:  # inherits from GlyphHeader
     actual_height: u8, Height of the glyph bitmap (w/o padding)
     texture_width: u8, Width of the texture in version 1(should be a power of 2)
     texture_height: u8, Height of the texture in version 1(should be a power of 2)'''
+    __slots__ = ('_table', '_index')
+
     def __init__(self, data:bytes=None, header:GlyphHeader=None, fnt_version=1, chara_index=None):
         if not header:
             if data:
                 header = GlyphHeader(data)
             else:
                 raise Exception("no Glyph data")
-        self.bearing_x = header.bearing_x
-        self.bearing_y = header.bearing_y
-        self.advance_width = header.advance_width
-        self.actual_width = header.actual_width
-        self.actual_height = header.actual_height
-        if fnt_version==1:
-            self.texture_width = header.texture_width
-            self.texture_height = header.texture_height
-            # true unicode: \u{unicode_index:04x}
-            self.unicode = chara_index
-        else:
-            # FNT4 v0 use Shift-JIS
-            self.sjis = map_sjis(chara_index)
+        # a standalone info is a proxy of a table with one glyph
+        self._table = GlyphTable.from_header(header, chara_index, fnt_version)
+        self._index = 0
+
+    @classmethod
+    def proxy(cls, table: GlyphTable, glyph_id: int) -> 'GlyphInfo':
+        info = cls.__new__(cls)
+        info._table = table
+        info._index = glyph_id
+        return info
+
+    bearing_x = _table_column('bearing_x', "i8, Distance between the current position of the pen and left of the glyph bitmap")
+    bearing_y = _table_column('bearing_y', "i8, Distance between the baseline and the top of the glyph bitmap")
+    advance_width = _table_column('advance_width', "u8, Amount of horizontal pen movements after drawing the glyph")
+    actual_width = _table_column('actual_width', "u8, Width of the glyph bitmap (w/o padding)")
+    actual_height = _table_column('actual_height', "u8, Height of the glyph bitmap (w/o padding)")
+    texture_width = _table_column('texture_width', "u8, Width of the texture in version 1", fnt_version=1)
+    texture_height = _table_column('texture_height', "u8, Height of the texture in version 1", fnt_version=1)
+    character = _table_column('character', "the first character code use this glyph (unicode in v1, index of CP932 table in v0)")
+    # true unicode: \u{unicode_index:04x}
+    unicode = _table_column('character', "character code (unicode) of FNT4 v1", fnt_version=1)
+
+    @property
+    def sjis(self) -> int:
+        # FNT4 v0 use Shift-JIS
+        if self._table.version != 0:
+            raise AttributeError("sjis only in FNT4 v0")
+        return map_sjis(self._table.character[self._index].item())
 
     def actual_size(self) -> tuple[int, int]:
         return (self.actual_width, self.actual_height)
@@ -176,20 +303,152 @@ class GlyphInfo:  # inherits from GlyphHeader
 
 
 class GlyphData:
-    def __init__(self, data: bytes, is_compressed: bool):
+    __slots__ = ('data', 'is_compressed', 'uncompressed_size', 'level0', 'stats', 'glyph_id')
+
+    def __init__(self, data: bytes, is_compressed: bool, uncompressed_size: int = 0, level0: np.ndarray = None,
+                 stats: Optional[FontStats] = None, glyph_id: int = -1):
         self.data = data
         self.is_compressed = is_compressed
+        self.uncompressed_size = uncompressed_size
+        self.level0 = level0  # decoded mip level 0 if already known (FontCache)
+        self.stats = stats  # record decompressions here if given
+        self.glyph_id = glyph_id  # key of this glyph in stats
+
+    def decompress(self,seekdata_len,backseek_len,limit=0) -> bytes:
+        # limit: only need the first limit bytes of decompressed data
+        if not self.is_compressed:
+            return self.data[:limit] if limit else self.data
+        stats = self.stats
+        if stats is None:
+            if limit:
+                return lz77.decompress(self.data,seekdata_len,backseek_len,min(limit,self.uncompressed_size),limit)
+            return lz77.decompress(self.data,seekdata_len,backseek_len,self.uncompressed_size)
+        start = time.perf_counter()
+        out_size = min(limit,self.uncompressed_size) if limit else self.uncompressed_size
+        data = lz77.decompress(self.data,seekdata_len,backseek_len,out_size,limit)
+        # same decode time for the glyph and the codec counters, tokens are counted after it
+        seconds = time.perf_counter() - start
+        stats.record_decode(self.glyph_id, seconds)
+        lz77.record_decompress(stats.decode,self.data,seekdata_len,backseek_len,limit,len(data),seconds)
+        return data
+
+
+def unpack_4bpp(data: bytes, width: int, height: int, out: np.ndarray=None) -> np.ndarray:
+    """
+    convert 4bpp texture of FNT4 v0 to 8bpp array [height, width],
+    every row is padded to stride ceil(width/2) bytes, high nibble is the left pixel.
+    out: write into this array (e.g. a view of a bigger array) instead of a new one
+    """
+    stride = math.ceil(width/2)
+    packed = np.frombuffer(data, dtype=np.uint8, count=stride*height).reshape([height, stride])
+    if out is None:
+        out = np.empty([height, width], dtype=np.uint8)
+    out[:, 0::2] = packed & 0xF0
+    out[:, 1::2] = (packed[:, :width//2] & 0x0F) << 4  # skip the padding nibble of odd width
+    return out
+
+
+def pack_4bpp(pixels: np.ndarray) -> bytes:
+    """inverse of unpack_4bpp, keep the high nibble of every pixel of [height, width] u8 array"""
+    height, width = pixels.shape
+    padded = np.zeros([height, math.ceil(width/2)*2], dtype=np.uint8)
+    padded[:, :width] = pixels
+    return ((padded[:, 0::2] & 0xF0) | (padded[:, 1::2] >> 4)).tobytes()
+
+
+def check_bitmap_size(width: int, height: int, fnt_version) -> None:
+    # u8 sizes in glyph header, FNT4 v1 texture side is the next power of 2, so the bitmap is at most 128
+    max_size = 0x80 if fnt_version==1 else 0xFF
+    if width > max_size or height > max_size:
+        raise ValueError(f"glyph bitmap too large: {width}x{height}, at most {max_size}x{max_size} in FNT4 v{fnt_version}")
+
+
+def texture_dimension(size: int) -> int:
+    # FNT4 v1 texture side of a glyph side: power of 2, at least 8 so mip level 3 has a pixel
+    return max(8, 1 << max(size - 1, 0).bit_length())
+
+
+def mip_chain(textures: np.ndarray) -> List[np.ndarray]:
+    """
+    the 4 mip levels of u8 textures [..., height, width] (any leading batch axes),
+    every level is the 2x2 box filter (rounded mean) of the one before
+    """
+    levels = [textures]
+    for _ in range(len(GlyphMipLevel) - 1):
+        level = levels[-1]
+        height, width = level.shape[-2] // 2, level.shape[-1] // 2
+        blocks = level[..., :height*2, :width*2].reshape([*level.shape[:-2], height, 2, width, 2]).astype(np.uint16)
+        levels.append(((blocks.sum(axis=(-3, -1)) + 2) >> 2).astype(np.uint8))
+    return levels
+
+
+def build_mip_levels(bitmap: np.ndarray, texture_size: Tuple[int, int]) -> bytes:
+    """
+    uncompressed FNT4 v1 glyph data: bitmap at the top-left of a texture_size texture,
+    followed by mip level 1-3 (see mip_chain)
+    """
+    width, height = texture_size
+    texture = np.zeros([height, width], dtype=np.uint8)
+    texture[:bitmap.shape[0], :bitmap.shape[1]] = bitmap
+    return b"".join(level.tobytes() for level in mip_chain(texture))
+
+
+def encode_bitmap(bitmap, fnt_version) -> Tuple[bytes, Tuple[int, int]]:
+    """
+    uncompressed glyph data and texture size of a [height, width] u8 gray bitmap (or PIL 'L' image),
+    4 mip levels in a power of 2 texture for FNT4 v1, 4bpp for FNT4 v0
+    """
+    bitmap = np.asarray(bitmap, dtype=np.uint8)
+    height, width = bitmap.shape
+    check_bitmap_size(width, height, fnt_version)
+    if fnt_version==1:
+        texture_size = (texture_dimension(width), texture_dimension(height))
+        return build_mip_levels(bitmap, texture_size), texture_size
+    return pack_4bpp(bitmap), (width, height)
 
-    def decompress(self,seekdata_len,backseek_len) -> bytes:
-        if self.is_compressed:
-            return lz77.decompress(self.data,seekdata_len,backseek_len)
-        return self.data
+
+def encode_bitmaps(bitmaps: List[np.ndarray], fnt_version) -> List[Tuple[bytes, Tuple[int, int]]]:
+    """encode_bitmap of many bitmaps, FNT4 v1 mip levels of the bitmaps with same texture size are built in one batch"""
+    if fnt_version != 1:
+        return [encode_bitmap(bitmap, fnt_version) for bitmap in bitmaps]
+    groups: Dict[Tuple[int, int], List[int]] = {}  # texture_size: indexes of bitmaps
+    for i, bitmap in enumerate(bitmaps):
+        height, width = np.shape(bitmap)
+        check_bitmap_size(width, height, fnt_version)
+        groups.setdefault((texture_dimension(width), texture_dimension(height)), []).append(i)
+    results = [None] * len(bitmaps)
+    for (width, height), indexes in groups.items():
+        textures = np.zeros([len(indexes), height, width], dtype=np.uint8)
+        for j, i in enumerate(indexes):
+            bitmap = np.asarray(bitmaps[i], dtype=np.uint8)
+            textures[j, :bitmap.shape[0], :bitmap.shape[1]] = bitmap
+        levels = mip_chain(textures)
+        for j, i in enumerate(indexes):
+            results[i] = (b"".join(level[j].tobytes() for level in levels), (width, height))
+    return results
+
+
+def unpack_4bpp_glyphs(glyphs: List['LazyGlyph'], out: np.ndarray=None) -> np.ndarray:
+    """
+    decompress and unpack many FNT4 v0 glyphs into one array [len(glyphs), max height, max width],
+    glyph i is at out[i, :height, :width] and the rest is 0
+    """
+    max_width = max((glyph.texture_size[0] for glyph in glyphs), default=0)
+    max_height = max((glyph.texture_size[1] for glyph in glyphs), default=0)
+    if out is None:
+        out = np.zeros([len(glyphs), max_height, max_width], dtype=np.uint8)
+    seek_bits, backseek_nbyte = LZ77_PARAMS[0]
+    for i, glyph in enumerate(glyphs):
+        width, height = glyph.texture_size
+        unpack_4bpp(glyph.glyph_data.decompress(seek_bits, backseek_nbyte), width, height, out[i, :height, :width])
+    return out
 
 
 # Glyph that has not been decompressed yet
 # Useful for on-demand decompression, as most of the glyphs are not needed right away by the game
 @dataclass
 class LazyGlyph:
+    __slots__ = ('info', 'texture_size', 'glyph_data')
     info: GlyphInfo
     texture_size: tuple[int, int]
     glyph_data: GlyphData
@@ -197,53 +456,54 @@ class LazyGlyph:
     def get_info(self) -> GlyphInfo:
         return self.info
 
-    def decompress(self, fnt_version) -> 'Glyph':
-        if fnt_version==1:  # FNT4 v1
-            seek_data_len = 10
-            backseek_data_len = 2
-        else:  # FNT4 v0
-            seek_data_len = 3
-            backseek_data_len = 1
-        decompress_bytes = self.glyph_data.decompress(seek_data_len,backseek_data_len)
-        data = io.BytesIO(decompress_bytes)
-
-        def read_texture(width:int, height:int, data:io.BytesIO) -> Image.Image:
-            image_data = np.frombuffer(data.read(width*height), dtype=np.uint8).reshape([height,width])
-            # return Image.frombytes('L', (width, height), image_data)
-            return Image.fromarray(image_data)
-        
-        def read_4bpp_texture(width:int, height:int, data:io.BytesIO) -> Image.Image:
-            pixel_data = io.BytesIO()
-            stride = math.ceil(width/2)
-            # convert 4bpp to 8bpp
-            for y in range(height):
-                # data.seek(y * stride)
-                row_data = data.read(stride)
-                x = 0
-                for byte_4bpp in row_data:
-                    # 每个字节根据高位和低位生成两个像素：
-                    byte_high = (byte_4bpp>>4)<<4
-                    pixel_data.write(bytes([byte_high]))
-                    if x+1<width:
-                        byte_low = (byte_4bpp&0xF)<<4
-                        pixel_data.write(bytes([byte_low]))
-                    x += 2
-            pixel_data.seek(0)
-            return read_texture(width, height, pixel_data)
-
+    def decode_arrays(self, fnt_version, mip_levels=tuple(GlyphMipLevel)) -> List[Optional[np.ndarray]]:
+        """
+        decompress the glyph and return [height, width] u8 arrays of the 4 mip levels,
+        levels not in mip_levels (and level 1-3 of FNT4 v0) are None.
+        FNT4 v1 arrays are read-only views into one decompressed buffer (no copy),
+        decompressing stops after the last level in mip_levels.
+        FNT4 v0 level 0 is unpacked from 4bpp
+        """
+        seek_data_len, backseek_data_len = LZ77_PARAMS[fnt_version]
+        arrays = [None] * len(GlyphMipLevel)
+        width, height = self.texture_size
+        level0 = self.glyph_data.level0
+        if level0 is not None and (fnt_version==0 or all(level==GlyphMipLevel.Level0 for level in mip_levels)):
+            if GlyphMipLevel.Level0 in mip_levels:
+                arrays[GlyphMipLevel.Level0] = level0
+            return arrays
         if fnt_version==1:
-            mip_level_0 = read_texture(self.texture_size[0], self.texture_size[1], data)
-            mip_level_1 = read_texture(self.texture_size[0] // 2, self.texture_size[1] // 2, data)
-            mip_level_2 = read_texture(self.texture_size[0] // 4, self.texture_size[1] // 4, data)
-            mip_level_3 = read_texture(self.texture_size[0] // 8, self.texture_size[1] // 8, data)
+            mip_offsets = [0]  # start of every mip level, and the end of last one
+            for level in GlyphMipLevel:
+                mip_offsets.append(mip_offsets[-1] + (width >> level.value) * (height >> level.value))
+            last_level = max(GlyphMipLevel(level) for level in mip_levels)
+            limit = mip_offsets[last_level + 1] if last_level != GlyphMipLevel.Level3 else 0
+            decompress_bytes = self.glyph_data.decompress(seek_data_len, backseek_data_len, limit)
+            for level in GlyphMipLevel:
+                if level in mip_levels:
+                    mip_width, mip_height = width >> level.value, height >> level.value
+                    arrays[level] = np.frombuffer(decompress_bytes, dtype=np.uint8, count=mip_width*mip_height,
+                                                  offset=mip_offsets[level]).reshape([mip_height, mip_width])
+            expected_len = limit or mip_offsets[-1]
         else:
-            mip_level_0 = read_4bpp_texture(self.texture_size[0], self.texture_size[1], data)
-            mip_level_1, mip_level_2, mip_level_3 = None, None, None
-        assert data.tell()==len(decompress_bytes), 'caculate decompress len error'
-        return Glyph(self.info, mip_level_0, mip_level_1, mip_level_2, mip_level_3)
+            decompress_bytes = self.glyph_data.decompress(seek_data_len, backseek_data_len)
+            if GlyphMipLevel.Level0 in mip_levels:
+                arrays[GlyphMipLevel.Level0] = unpack_4bpp(decompress_bytes, width, height)
+            expected_len = math.ceil(width/2) * height
+        assert expected_len==len(decompress_bytes), 'caculate decompress len error'
+        return arrays
+
+    def decode_level0(self, fnt_version) -> np.ndarray:
+        # only the full resolution mip level, the rest of glyph data is not decompressed
+        return self.decode_arrays(fnt_version, [GlyphMipLevel.Level0])[GlyphMipLevel.Level0]
+
+    def decompress(self, fnt_version) -> 'Glyph':
+        # PIL images of decode_arrays
+        images = [None if array is None else Image.fromarray(array) for array in self.decode_arrays(fnt_version)]
+        return Glyph(self.info, *images)
 
     @classmethod
-    def read(cls, data: bytes, offset, chara_code, fnt_version):
+    def read(cls, data: bytes, offset, chara_code, fnt_version, stats: Optional[FontStats]=None):
         glyph_header = GlyphHeader(data, offset, fnt_version)
         compressed_size = glyph_header.compressed_size
         if fnt_version==1:
@@ -255,27 +515,65 @@ class LazyGlyph:
             stride = math.ceil(glyph_header.actual_width/2)
             uncompressed_size = stride * glyph_header.actual_height
         info = GlyphInfo(header=glyph_header,fnt_version=fnt_version,chara_index=chara_code)
-        # debug
-        if hasattr(info,"unicode") and 19968<=info.unicode<=40959:
-            global LOG_ADW,LOG_OFS
-            if info.advance_width not in LOG_ADW:
-                LOG_ADW.append(info.advance_width)
-            if (info.bearing_x, info.bearing_y) not in LOG_OFS:
-                LOG_OFS.append((info.bearing_x, info.bearing_y))
-        # debug end
+        if stats is not None:
+            stats.record_glyph(info, texture_size, chara_code if fnt_version==1 else None)
         # 获取未压缩/解压后的数据 get uncompressed/decompressed data
-        reader = io.BytesIO(data)
-        reader.seek(offset+glyph_header.size)
+        # slice of data only, zero-copy when data is a memoryview (Font.open)
+        start = offset + glyph_header.size
         if compressed_size == 0:
-            data = reader.read(uncompressed_size)
+            data = data[start:start+uncompressed_size]
             is_compressed = False
         else:
-            data = reader.read(compressed_size)
+            data = data[start:start+compressed_size]
             is_compressed = True
 
-        data = GlyphData(data, is_compressed)
+        data = GlyphData(data, is_compressed, uncompressed_size, stats=stats)
         return cls(info, texture_size, data)
 
+    @classmethod
+    def from_table(cls, data: bytes, table: GlyphTable, glyph_id: int, level0: np.ndarray=None,
+                   stats: Optional[FontStats]=None) -> 'LazyGlyph':
+        # lazy glyph of glyph_id in table, info is a proxy of the table
+        start = table.data_offset[glyph_id].item()
+        compressed_size = table.compressed_size[glyph_id].item()
+        uncompressed_size = table.uncompressed_size[glyph_id].item()
+        if compressed_size == 0:
+            glyph_data = GlyphData(data[start:start+uncompressed_size], False, uncompressed_size, level0, stats, glyph_id)
+        else:
+            glyph_data = GlyphData(data[start:start+compressed_size], True, uncompressed_size, level0, stats, glyph_id)
+        texture_size = (table.texture_width[glyph_id].item(), table.texture_height[glyph_id].item())
+        return cls(GlyphInfo.proxy(table, glyph_id), texture_size, glyph_data)
+
+@dataclass
+class GlyphEdit:
+    """
+    new bitmap and/or metrics of a character for Font.patch, None keeps the old one.
+    bitmap: [actual_height, actual_width] u8 gray array (or PIL 'L' image) of mip level 0 without padding
+    """
+    bitmap: Optional[np.ndarray] = None
+    bearing_x: Optional[int] = None
+    bearing_y: Optional[int] = None
+    advance_width: Optional[int] = None
+
+    def apply(self, glyph: LazyGlyph, character: int, fnt_version) -> LazyGlyph:
+        # the edited copy of glyph, glyph data is kept as is if no new bitmap
+        info = glyph.info
+        header = GlyphHeader(None, fnt_version=fnt_version)
+        header.bearing_x = info.bearing_x if self.bearing_x is None else self.bearing_x
+        header.bearing_y = info.bearing_y if self.bearing_y is None else self.bearing_y
+        header.advance_width = info.advance_width if self.advance_width is None else self.advance_width
+        if self.bitmap is None:
+            header.actual_width, header.actual_height = info.actual_width, info.actual_height
+            texture_size, glyph_data = glyph.texture_size, glyph.glyph_data
+        else:
+            data, texture_size = encode_bitmap(self.bitmap, fnt_version)
+            header.actual_height, header.actual_width = np.shape(self.bitmap)[:2]
+            glyph_data = GlyphData(data, False, len(data))
+        if fnt_version==1:
+            header.texture_width, header.texture_height = texture_size
+        return LazyGlyph(GlyphInfo(header=header, fnt_version=fnt_version, chara_index=character), texture_size, glyph_data)
+
+
 # Glyph that has been decompressed
 @dataclass
 class Glyph:
@@ -293,12 +591,258 @@ class Glyph:
             GlyphMipLevel.Level3: self.mip_level_3,
         }[mip_level]
 
+    def nbytes(self) -> int:
+        # bytes of pixel data in all mip levels
+        return sum(image.width * image.height * len(image.getbands())
+                   for image in (self.mip_level_0, self.mip_level_1, self.mip_level_2, self.mip_level_3) if image)
+
     @classmethod
-    def read(cls, data:bytes, offset, chara_i, fnt_version):
-        lazy_glyph = LazyGlyph.read(data, offset, chara_i, fnt_version)
+    def read(cls, data:bytes, offset, chara_i, fnt_version, stats: Optional[FontStats]=None):
+        lazy_glyph = LazyGlyph.read(data, offset, chara_i, fnt_version, stats)
         return lazy_glyph
 
 
+class GlyphCache:
+    """
+    LRU cache of decompressed glyphs (glyph_id: Glyph), bounded by max_bytes of their pixel data.
+    hits/misses/evictions count the lookups, all methods are thread-safe
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0  # bytes of glyphs in cache
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._glyphs: OrderedDict[int, Tuple[Glyph, int]] = OrderedDict()  # glyph_id: (glyph, nbytes), oldest first
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._glyphs)
+
+    def __contains__(self, glyph_id: int) -> bool:
+        # no effect on hits/misses and the LRU order
+        with self._lock:
+            return glyph_id in self._glyphs
+
+    def get(self, glyph_id: int) -> Optional[Glyph]:
+        with self._lock:
+            item = self._glyphs.get(glyph_id)
+            if item is None:
+                self.misses += 1
+                return None
+            self._glyphs.move_to_end(glyph_id)
+            self.hits += 1
+            return item[0]
+
+    def put(self, glyph_id: int, glyph: Glyph) -> None:
+        nbytes = glyph.nbytes()
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if glyph_id in self._glyphs:  # decoded by another thread meanwhile
+                self._glyphs.move_to_end(glyph_id)
+                return
+            self._glyphs[glyph_id] = (glyph, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, evicted_nbytes) = self._glyphs.popitem(last=False)
+                self.size -= evicted_nbytes
+                self.evictions += 1
+
+    def discard(self, glyph_id: int) -> None:
+        # drop a glyph which is replaced or removed from the font
+        with self._lock:
+            item = self._glyphs.pop(glyph_id, None)
+            if item is not None:
+                self.size -= item[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._glyphs.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'glyphs': len(self._glyphs), 'size': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class GlyphPrefetcher:
+    """
+    decode the glyphs of upcoming text into Font.glyph_cache on background threads,
+    so drawing text that was prefetched never waits on lz77 decoding.
+    glyphs wait in a bounded queue (max_pending), text that doesn't fit is not prefetched,
+    cancel() drops the queued glyphs (e.g. when the reader skips ahead), close() stops the threads
+    """
+    def __init__(self, font: 'Font', workers: int = 2, max_pending: int = 1024):
+        if font.glyph_cache is None:
+            font.enable_glyph_cache()
+        self.font = font
+        self.decoded = 0  # glyphs decoded by the threads
+        self.dropped = 0  # glyphs not queued because the queue was full
+        self.errors: List[Tuple[int, Exception]] = []  # (glyph_id, error) of failed decodes
+        self._queue: queue.Queue = queue.Queue(max_pending)  # (generation, glyph_id), None to stop a thread
+        self._queued = set()  # glyph_ids in queue of current generation
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, name=f"glyph-prefetch-{i}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def glyph_ids(self, lines: List[str]) -> List[int]:
+        # unique glyph_ids of the characters in lines, in order of appearance, characters not in font are skipped
+        text = ''.join(lines)
+        if self.font.version==0:
+            codes = unicode_to_codes(text)
+        else:
+            codes = np.frombuffer(text.encode('utf-32-le'), dtype='<u4').astype(np.int64)
+        characters = self.font.characters
+        characters = np.frombuffer(characters, dtype=np.uint32) if isinstance(characters, array) else np.asarray(characters)
+        codes = codes[(codes >= 0) & (codes < len(characters))]
+        return list(dict.fromkeys(characters[codes].tolist()))
+
+    def prefetch(self, lines: List[str]) -> int:
+        """queue the glyphs of the next lines which are not decoded yet, return the number of queued glyphs"""
+        cache = self.font.glyph_cache
+        queued = 0
+        with self._lock:
+            generation = self._generation
+            for glyph_id in self.glyph_ids(lines):
+                if glyph_id in self._queued or glyph_id in cache:
+                    continue
+                try:
+                    self._queue.put_nowait((generation, glyph_id))
+                except queue.Full:
+                    self.dropped += 1
+                    continue
+                self._queued.add(glyph_id)
+                queued += 1
+        return queued
+
+    def cancel(self) -> int:
+        """drop the queued glyphs (a glyph being decoded still finishes), return the number of dropped glyphs"""
+        dropped = 0
+        with self._lock:
+            self._generation += 1
+            self._queued.clear()
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._queue.task_done()
+                dropped += 1
+        return dropped
+
+    def join(self) -> None:
+        # wait until all queued glyphs are decoded
+        self._queue.join()
+
+    def close(self) -> None:
+        self.cancel()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self) -> 'GlyphPrefetcher':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                generation, glyph_id = item
+                if generation != self._generation:  # cancelled
+                    continue
+                error = None
+                try:
+                    self.font.decode_glyph(glyph_id)
+                except Exception as e:
+                    error = e
+                with self._lock:  # counters are updated by every worker thread
+                    if error is None:
+                        self.decoded += 1
+                    else:
+                        self.errors.append((glyph_id, error))
+                    if generation == self._generation:
+                        self._queued.discard(glyph_id)
+            finally:
+                self._queue.task_done()
+
+
+class GlyphStore(MutableMapping):
+    """
+    glyph_id: LazyGlyph of the glyphs in a GlyphTable, the LazyGlyph (and its GlyphInfo proxy)
+    is created on every access instead of kept for every glyph,
+    so set the item to replace a glyph, changes to attributes of a returned LazyGlyph are not kept
+    """
+    def __init__(self, data: bytes, table: GlyphTable, cache: Optional['FontCache']=None,
+                 stats: Optional[FontStats]=None):
+        self.data = data
+        self.table = table
+        self.cache = cache  # decoded mip level 0 of the glyphs in table
+        self.stats = stats  # passed to every LazyGlyph of table
+        self._replaced: Dict[int, LazyGlyph] = {}
+        self._deleted = set()
+
+    def _in_table(self, glyph_id) -> bool:
+        return 0 <= glyph_id < len(self.table) and glyph_id not in self._deleted
+
+    def __getitem__(self, glyph_id: int) -> LazyGlyph:
+        glyph = self._replaced.get(glyph_id)
+        if glyph is not None:
+            return glyph
+        if not self._in_table(glyph_id):
+            raise KeyError(glyph_id)
+        level0 = self.cache.level0(glyph_id) if self.cache else None
+        return LazyGlyph.from_table(self.data, self.table, glyph_id, level0, self.stats)
+
+    def stored_record(self, glyph_id: int) -> Optional[bytes]:
+        # glyph header and data of an untouched glyph as they are in font data, None if the glyph was set or deleted
+        if glyph_id in self._replaced or not self._in_table(glyph_id):
+            return None
+        table = self.table
+        stored_size = table.compressed_size[glyph_id].item() or table.uncompressed_size[glyph_id].item()
+        return self.data[table.offset[glyph_id].item():table.data_offset[glyph_id].item()+stored_size]
+
+    def __setitem__(self, glyph_id: int, glyph: LazyGlyph) -> None:
+        self._deleted.discard(glyph_id)
+        self._replaced[glyph_id] = glyph
+
+    def __delitem__(self, glyph_id: int) -> None:
+        if glyph_id not in self:
+            raise KeyError(glyph_id)
+        self._replaced.pop(glyph_id, None)
+        if 0 <= glyph_id < len(self.table):
+            self._deleted.add(glyph_id)
+
+    def __contains__(self, glyph_id) -> bool:
+        return glyph_id in self._replaced or self._in_table(glyph_id)
+
+    def modified(self) -> bool:
+        # True if any glyph was set or deleted, table no longer describes all glyphs
+        return bool(self._replaced or self._deleted)
+
+    def __iter__(self):
+        for glyph_id in range(len(self.table)):
+            if glyph_id not in self._deleted:
+                yield glyph_id
+        for glyph_id in self._replaced:
+            if not 0 <= glyph_id < len(self.table):
+                yield glyph_id
+
+    def __len__(self) -> int:
+        extra = sum(1 for glyph_id in self._replaced if not 0 <= glyph_id < len(self.table))
+        return len(self.table) - len(self._deleted) + extra
+
+
 @dataclass
 class Font:
     version: int
@@ -306,12 +850,16 @@ class Font:
     descent: int  # Distance between the baseline and the bottom of the font
     fdata: bytes
     character_table_crc: int  # Used as a font identifier for glyph caching
-    characters: List[int] # = field(default_factory=lambda: [0]*0x10000)
-    glyphs: Dict[int, LazyGlyph] = field(default_factory=dict)
-    dbg_offsets: List[int] = field(default_factory=list)
+    characters: List[int] # [GlyphId]*character_size, array('I') when read
+    glyphs: Dict[int, LazyGlyph] = field(default_factory=dict)  # GlyphStore when read
+    dbg_offsets: List[int] = field(default_factory=list)  # the characters table, u32 view of fdata when read
+    glyph_cache: Optional[GlyphCache] = None  # decompressed glyphs, see enable_glyph_cache
+    glyph_table: Optional[GlyphTable] = None  # columnar glyph headers of the read font, None once patched/deduped
+    stats: Optional[FontStats] = None  # opt-in metric histograms and decode times, see Font.read
 
     @classmethod
-    def read(cls, data):
+    def read(cls, data, stats: Optional[FontStats]=None):
+        # stats: record the glyph metrics of the font and every glyph decompression in it
         # 读取头部 check header
         header = FontHeader(data)
         # 检查数据大小 check whole data length
@@ -319,28 +867,53 @@ class Font:
             raise ValueError(f"Font size in header does not match actual stream size")
         
         # 计算字符表大小  calculate characters table size(in test)
-        character_size = int((struct.unpack('<I',data[0x10:0x14])[0]-0x10)/4)
+        character_size = (struct.unpack_from('<I', data, 0x10)[0]-0x10) // 4
 
-        # 读取字符表 read the unicode characters table
-        character_table:List[int] = character_size * [0] # unicode: addr
-        for i in range(character_size):
-            start = i*4 + header.size
-            character_table[i] = int.from_bytes(data[start: start+4], "little", signed=False)
+        # 读取字符表 read the unicode characters table, as u32 array view of data
+        character_table = np.frombuffer(data, dtype='<u4', count=character_size, offset=header.size)
         
         # 计算字符表CRC32校验和  calculate character table CRC32
-        character_table_bytes = struct.pack(f'<{len(character_table)}I', *character_table)
-        character_table_crc = crc32.crc32(character_table_bytes, 0)
+        character_table_crc = crc32.crc32(data[header.size:header.size+4*character_size], 0)
         
         # 读取字形数据 read the glyph data in characters table
-        known_glyph_offsets = defaultdict(lambda: len(known_glyph_offsets))
-        characters = [0]*character_size  # [GlyphId]*character_size
-        glyphs = {}
-        for character_index, glyph_offset in enumerate(character_table):
-            glyph_id = known_glyph_offsets[glyph_offset]
-            characters[character_index] = glyph_id
-            if glyph_id in glyphs.keys(): continue
-            glyphs[glyph_id] = Glyph.read(data, glyph_offset, character_index, header.version)
-        return cls(header.version, header.ascent, header.descent, data, character_table_crc, characters, glyphs,character_table)
+        # glyph id of an offset is the order of its first appearance in characters table
+        glyph_offsets, first_index, inverse = np.unique(character_table, return_index=True, return_inverse=True)
+        order = np.argsort(first_index, kind='stable')  # glyph_id -> index of glyph_offsets
+        glyph_ids = np.empty_like(order)
+        glyph_ids[order] = np.arange(len(order))
+        characters = array('I', glyph_ids[inverse].astype(np.uint32).tobytes())  # [GlyphId]*character_size
+        glyph_table = GlyphTable.read(data, glyph_offsets[order], first_index[order], header.version)
+        glyphs = GlyphStore(data, glyph_table, stats=stats)
+        if stats is not None:
+            stats.record_table(glyph_table)
+        return cls(header.version, header.ascent, header.descent, data, character_table_crc, characters, glyphs,character_table,
+                   glyph_table=glyph_table, stats=stats)
+
+    @classmethod
+    def open(cls, path: str, cache=False, stats: Optional[FontStats]=None) -> 'Font':
+        """
+        read font from a memory-mapped file, fdata and glyph data are memoryview slices of the map,
+        so only the headers are read on open, glyph data are paged in when decompressed.
+        the map is released when no font/glyph data refer to it.
+        cache: True to use the FontCache sidecar file {path}.cache, or the path of cache file,
+        the glyph table and decoded mip level 0 are loaded from it (created when missing or out of date)
+        stats: see Font.read
+        """
+        with open(path, 'rb') as fp:
+            fmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(fp.fileno())
+        data = memoryview(fmap)
+        if not cache:
+            return cls.read(data, stats)
+        cache_path = cache if isinstance(cache, str) else path + '.cache'
+        font = FontCache.load_font(cache_path, data, stat, stats)
+        if font is None:
+            try:
+                FontCache.write(cache_path, cls.read(data), stat)
+            except OSError:  # read-only directory or media, open without cache
+                return cls.read(data, stats)
+            font = FontCache.load_font(cache_path, data, stat, stats)
+        return font
 
     # Get the sum of the ascent and descent, giving the total height of the font
     def get_line_height(self) -> int:
@@ -358,6 +931,270 @@ class Font:
     def get_character_mapping(self) -> List[int]:
         return self.characters
 
+    def enable_glyph_cache(self, max_bytes: int = 64 << 20) -> GlyphCache:
+        # opt-in, keep up to max_bytes of decompressed glyphs for get_decoded/decode_glyph
+        self.glyph_cache = GlyphCache(max_bytes)
+        return self.glyph_cache
+
+    def prefetcher(self, workers: int = 2, max_pending: int = 1024) -> GlyphPrefetcher:
+        # background decoding of upcoming text into glyph_cache (enabled if not yet), see GlyphPrefetcher
+        return GlyphPrefetcher(self, workers, max_pending)
+
+    def decode_glyph(self, glyph_id: int) -> Glyph:
+        cache = self.glyph_cache
+        if cache is None:
+            return self.glyphs[glyph_id].decompress(self.version)
+        glyph = cache.get(glyph_id)
+        if glyph is None:
+            glyph = self.glyphs[glyph_id].decompress(self.version)
+            cache.put(glyph_id, glyph)
+        return glyph
+
+    def get_decoded(self, character: int) -> Glyph:
+        return self.decode_glyph(self.characters[character])
+
+    def to_bytes(self, workers: Optional[int]=None, level=lz77.CompressLevel.Lazy) -> bytes:
+        """
+        pack the font to FNT4 data in its own version,
+        untouched glyphs of a read font are copied as is (header and data), so is other glyph data
+        which is already compressed, the rest are compressed in a process pool (set workers=1 to compress in this process)
+        """
+        # glyphs in order of first appearance in characters table (as glyph_id of Font.read),
+        # the first offset in characters table is where glyph data start, which gives the table size
+        glyph_ids = [glyph_id for glyph_id in dict.fromkeys(self.characters) if glyph_id in self.glyphs]
+        glyph_ids += sorted(set(self.glyphs.keys()).difference(glyph_ids))  # glyphs no character use
+        store = self.glyphs if isinstance(self.glyphs, GlyphStore) else None
+        records = {glyph_id: store.stored_record(glyph_id) for glyph_id in glyph_ids} if store else {}
+        seek_bits, backseek_nbyte = LZ77_PARAMS[self.version]
+        jobs = []
+        for glyph_id in glyph_ids:
+            if records.get(glyph_id) is None:
+                glyph_data = self.glyphs[glyph_id].glyph_data
+                if not glyph_data.is_compressed:
+                    jobs.append((bytes(glyph_data.data), seek_bits, backseek_nbyte, level))
+        compressed_iter = iter(pool_map(_compress_glyph, jobs, workers))
+
+        # glyph data start right after the header and characters table
+        offset = 0x10 + 4*len(self.characters)
+        glyph_offsets = {}  # glyph_id: offset
+        glyph_parts = []
+        for glyph_id in glyph_ids:
+            glyph_offsets[glyph_id] = offset
+            record = records.get(glyph_id)
+            if record is not None:
+                glyph_parts.append(record)
+                offset += len(record)
+                if offset % 2:
+                    glyph_parts.append(b"\x00")
+                    offset += 1
+                continue
+            glyph = self.glyphs[glyph_id]
+            raw_data = glyph.glyph_data.data
+            if glyph.glyph_data.is_compressed:
+                data = raw_data
+                compressed_size = len(data)
+            else:
+                data, compressed_size = stored_glyph_data(raw_data, next(compressed_iter))
+            header = GlyphHeader.from_info(glyph.info, compressed_size, self.version)
+            glyph_parts.append(header.tobytes())
+            glyph_parts.append(bytes(data))
+            offset += header.size + len(data)
+            if offset % 2:  # glyphs are aligned to 2 bytes
+                glyph_parts.append(b"\x00")
+                offset += 1
+
+        character_table = [glyph_offsets[glyph_id] for glyph_id in self.characters]
+        return b"".join([
+            FontHeader.build(self.version, offset, self.ascent, self.descent),
+            struct.pack(f'<{len(character_table)}I', *character_table),
+            *glyph_parts,
+        ])
+
+    def write(self, path: str, workers: Optional[int]=None, level=lz77.CompressLevel.Lazy) -> None:
+        with open(path, 'wb') as fp:
+            fp.write(self.to_bytes(workers, level))
+
+    def patch(self, edits: Dict[int, GlyphEdit]) -> None:
+        """
+        apply new bitmaps/metrics of characters (character code: GlyphEdit) to the font,
+        only the edited glyphs are replaced, so to_bytes compresses them and copies all the others.
+        a glyph shared with characters that are not edited is kept for them, the edited character gets a new glyph_id
+        """
+        glyph_characters = Counter(self.characters)  # glyph_id: characters use it
+        next_glyph_id = max(self.glyphs.keys(), default=-1) + 1
+        for character, edit in edits.items():
+            if not 0 <= character < len(self.characters):
+                raise KeyError(f"character {character} not in font")
+            glyph_id = self.characters[character]
+            glyph = edit.apply(self.glyphs[glyph_id], character, self.version)
+            if glyph_characters[glyph_id] > 1:
+                glyph_characters[glyph_id] -= 1
+                glyph_id = next_glyph_id
+                next_glyph_id += 1
+                glyph_characters[glyph_id] = 1
+                self.characters[character] = glyph_id
+            self.glyphs[glyph_id] = glyph
+            if self.glyph_cache is not None:
+                self.glyph_cache.discard(glyph_id)
+        if edits:
+            self.glyph_table = None  # stale, headers of the read font
+
+    def dedup(self) -> int:
+        """
+        point the characters of glyphs with the same decoded bitmap and metrics at one glyph (the first one
+        in characters table) and remove the other glyphs, return the number of removed glyphs.
+        glyphs are grouped by metrics first, only glyphs sharing metrics with another are decompressed and hashed
+        """
+        seek_bits, backseek_nbyte = LZ77_PARAMS[self.version]
+        groups: Dict[tuple, List[int]] = {}  # metrics: glyph_ids
+        for glyph_id in dict.fromkeys(self.characters):
+            glyph = self.glyphs[glyph_id]
+            info = glyph.info
+            metrics = (info.bearing_x, info.bearing_y, info.actual_width, info.actual_height, info.advance_width,
+                       tuple(glyph.texture_size))
+            groups.setdefault(metrics, []).append(glyph_id)
+
+        remap = {}  # duplicate glyph_id: kept glyph_id
+        for metrics, glyph_ids in groups.items():
+            if len(glyph_ids) < 2:
+                continue
+            kept = {}  # glyph_digest: glyph_id
+            for glyph_id in glyph_ids:
+                decoded = self.glyphs[glyph_id].glyph_data.decompress(seek_bits, backseek_nbyte)
+                first = kept.setdefault(glyph_digest(metrics, decoded), glyph_id)
+                if first != glyph_id:
+                    remap[glyph_id] = first
+        if remap:
+            characters = [remap.get(glyph_id, glyph_id) for glyph_id in self.characters]
+            self.characters = array('I', characters) if isinstance(self.characters, array) else characters
+            for glyph_id in remap:
+                del self.glyphs[glyph_id]
+                if self.glyph_cache is not None:
+                    self.glyph_cache.discard(glyph_id)
+            self.glyph_table = None  # stale, headers of the read font
+        return len(remap)
+
+    def repack(self, edits: Dict[int, GlyphEdit], workers: Optional[int]=None, level=lz77.CompressLevel.Lazy,
+               dedup=False) -> bytes:
+        # patch the font and pack it, the time is proportional to the number of edited glyphs (unless dedup)
+        self.patch(edits)
+        if dedup:
+            self.dedup()
+        return self.to_bytes(workers, level)
+
+
+class FontCache:
+    """
+    memory-mapped sidecar file of a font, has the parsed glyph table and decoded mip level 0 of all glyphs,
+    keyed by character_table_crc, file size and mtime of the font (out of date cache is rewritten by Font.open).
+    layout: CACHE_HEADER | characters u32[character_size] | CACHE_GLYPH_DTYPE[glyph_count]
+            | GLYPH_HEADER_DTYPES[fnt_version][glyph_count] | pixels
+    """
+    MAGIC = b"FNT4CACH"
+    VERSION = 1
+    HEADER = struct.Struct('<8s2I2Q3I')  # magic, VERSION, crc, fsize, mtime_ns, fnt_version, character_size, glyph_count
+    GLYPH_DTYPE = np.dtype([('offset', '<u4'), ('character', '<u4'), ('pixel_offset', '<u8'), ('width', '<u2'), ('height', '<u2')])
+
+    def __init__(self, buffer, glyphs: np.ndarray, pixels_start: int):
+        self.buffer = buffer
+        self.glyphs = glyphs
+        self.pixels_start = pixels_start
+
+    def level0(self, glyph_id: int) -> np.ndarray:
+        pixel_offset, width, height = self.glyphs[['pixel_offset', 'width', 'height']][glyph_id].tolist()
+        return np.frombuffer(self.buffer, dtype=np.uint8, count=width*height,
+                             offset=self.pixels_start+pixel_offset).reshape([height, width])
+
+    @classmethod
+    def write(cls, path: str, font: 'Font', stat: os.stat_result) -> None:
+        table = font.glyph_table
+        glyphs = np.zeros(len(table), dtype=cls.GLYPH_DTYPE)
+        glyphs['offset'] = table.offset
+        glyphs['character'] = table.character
+        glyphs['width'] = table.texture_width
+        glyphs['height'] = table.texture_height
+        sizes = glyphs['width'].astype(np.uint64) * glyphs['height']
+        glyphs['pixel_offset'] = np.cumsum(sizes) - sizes
+        headers = read_glyph_headers(font.fdata, table.offset, font.version)
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as fp:
+                fp.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, font.character_table_crc, stat.st_size, stat.st_mtime_ns,
+                                         font.version, len(font.characters), len(table)))
+                fp.write(np.asarray(font.characters, dtype='<u4').tobytes())
+                fp.write(glyphs.tobytes())
+                fp.write(headers.tobytes())
+                for glyph_id in range(len(table)):
+                    fp.write(font.glyphs[glyph_id].decode_level0(font.version).tobytes())
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):  # e.g. disk full, don't leave a partial file
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load_font(cls, path: str, data: bytes, stat: os.stat_result, stats: Optional[FontStats]=None) -> Optional['Font']:
+        """Font of data with glyph table and level 0 from the cache, None if no cache or it is out of date"""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as fp:
+            buffer = memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+        if len(buffer) < cls.HEADER.size:
+            return None
+        magic, version, crc, fsize, mtime_ns, fnt_version, character_size, glyph_count = cls.HEADER.unpack_from(buffer)
+        if magic != cls.MAGIC or version != cls.VERSION or fsize != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            return None
+        header = FontHeader(data)
+        character_table_crc = crc32.crc32(data[header.size:header.size+4*character_size], 0)
+        if crc != character_table_crc or fnt_version != header.version:
+            return None
+
+        offset = cls.HEADER.size
+        characters = array('I', buffer[offset:offset+4*character_size].tobytes())
+        offset += 4*character_size
+        glyphs = np.frombuffer(buffer, dtype=cls.GLYPH_DTYPE, count=glyph_count, offset=offset)
+        offset += glyphs.nbytes
+        headers = np.frombuffer(buffer, dtype=GLYPH_HEADER_DTYPES[fnt_version], count=glyph_count, offset=offset)
+        offset += headers.nbytes
+        glyph_table = GlyphTable(headers, glyphs['offset'], glyphs['character'], fnt_version)
+        glyph_store = GlyphStore(data, glyph_table, cls(buffer, glyphs, offset), stats)
+        if stats is not None:
+            stats.record_table(glyph_table)
+        character_table = np.frombuffer(data, dtype='<u4', count=character_size, offset=header.size)
+        return Font(header.version, header.ascent, header.descent, data, character_table_crc, characters, glyph_store,
+                    character_table, glyph_table=glyph_table, stats=stats)
+
+
+def stored_glyph_data(data: bytes, compressed: bytes) -> Tuple[bytes, int]:
+    # glyph data to store and compressed_size of its header, compressed_size 0 means uncompressed data,
+    # stored so when compressing doesn't make it smaller or the size can't fit in u16
+    if len(compressed) >= len(data) or len(compressed) > 0xFFFF:
+        return data, 0
+    return compressed, len(compressed)
+
+
+def glyph_digest(metrics: tuple, data: bytes) -> bytes:
+    # content hash of a glyph, metrics: (bearing_x, bearing_y, actual_width, actual_height, advance_width, texture_size),
+    # data: uncompressed glyph data
+    return hashlib.blake2b(repr(metrics).encode() + bytes(data), digest_size=16).digest()
+
+
+def _compress_glyph(job) -> bytes:
+    # job: (data, seek_bits, backseek_nbyte, level), module level for pickling to worker process
+    data, seek_bits, backseek_nbyte, level = job
+    return lz77.compress(data, seek_bits, backseek_nbyte, level)
+
+
+def pool_map(fn, jobs: list, workers: Optional[int]=None) -> list:
+    """map jobs in a process pool and keep the order of results,
+    run in this process if workers<=1 or only one job"""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        return [fn(job) for job in jobs]
+    chunksize = max(1, len(jobs) // (workers*4))
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(fn, jobs, chunksize=chunksize))
+
 
 # def read_font(reader: io.BytesIO) -> Font:
 #     return Font.read(reader)
@@ -369,97 +1206,346 @@ def read_lazy_font(read_data: bytes) -> Font:
 #     return Font.read(reader)
 
 
-def build_cp932_table():
-    global CP932_SJIS
-    code_point = 0
-    # single byte
-    for sjis in range(0x20,0x7F+0x1):
-        CP932_SJIS[code_point] = sjis
-        code_point += 1
-    for sjis in range(0xa0,0xdf+0x1):
-        CP932_SJIS[code_point] = sjis
-        code_point += 1
-    # double byte sjis
-    for high_byte in range(0x8100,0x9f00+0x100,0x100):
-        for sjis in range(high_byte+0x40,high_byte+0xFC+0x1):
-            if sjis&0x7f==0x7f:
-                assert hex(sjis)[-2:]=='7f'
-                continue
-            CP932_SJIS[code_point] = sjis
-            code_point += 1
-    for high_byte in range(0xe000,0xee00+0x100,0x100):  # contain NEC ext-range
-        for sjis in range(high_byte+0x40,high_byte+0xFC+0x1):
-            if sjis&0x7f==0x7f:
-                assert hex(sjis)[-2:]=='7f'
-                continue
-            CP932_SJIS[code_point] = sjis
-            code_point += 1
+def _table_lookup(table: array, values, missing: int = -1) -> np.ndarray:
+    # table[values] for an int array, missing where values are out of table
+    lookup = np.frombuffer(table, dtype=table.typecode)
+    values = np.asarray(values, dtype=np.int64)
+    in_table = (values >= 0) & (values < len(lookup))
+    # signed, or missing would wrap to 0xFFFF in the u16 tables
+    return np.where(in_table, lookup[np.where(in_table, values, 0)].astype(np.int32), np.int32(missing))
 
 
-def map_sjis(sjis_codepoint: int):
-    global CP932_SJIS
-    if not CP932_SJIS:
-        build_cp932_table()
-    return CP932_SJIS.get(sjis_codepoint)
+def codes_to_sjis(codes) -> np.ndarray:
+    """sjis of FNT4 v0 character codes, -1 if out of CP932 table"""
+    return _table_lookup(CP932_SJIS, codes)
 
 
-def main():
-    os.chdir(os.path.dirname(__file__))
-    font_path = r""  # set fnt(FNT4) file path here
-    output_path = r""  # set glyph output path here
+def sjis_to_codes(sjis) -> np.ndarray:
+    """FNT4 v0 character codes of sjis values, -1 if not in CP932 table"""
+    return _table_lookup(SJIS_CP932, sjis)
+
+
+def codes_to_unicode(codes) -> np.ndarray:
+    """unicode of FNT4 v0 character codes, -1 if no such character"""
+    unicode = _table_lookup(CP932_UNICODE, codes, 0)
+    return np.where(unicode == 0, -1, unicode)
+
+
+def unicode_to_codes(text) -> np.ndarray:
+    """FNT4 v0 character codes of a str or an array of unicode, -1 if cp932 has no such character"""
+    if isinstance(text, str):
+        text = np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+    return _table_lookup(UNICODE_CP932, text)
+
+
+def codes_to_text(codes, missing: str = '\ufffd') -> str:
+    """str of FNT4 v0 character codes, missing for codes without a character"""
+    unicode = codes_to_unicode(codes)
+    return np.where(unicode < 0, ord(missing), unicode).astype('<u4').tobytes().decode('utf-32-le')
+
+
+def test_cp932_tables():
+    codes = np.arange(len(CP932_SJIS))
+    assert codes_to_sjis(codes).tolist() == CP932_SJIS.tolist()
+    assert sjis_to_codes(CP932_SJIS).tolist() == codes.tolist()
+    unicode = codes_to_unicode(codes)
+    mapped = np.flatnonzero(unicode >= 0)
+    for code in mapped.tolist():
+        sjis = CP932_SJIS[code]
+        assert chr(unicode[code]) == sjis.to_bytes(2 if sjis > 0xFF else 1, 'big').decode('cp932')
+    # NEC duplicates map back to the first code of the character
+    text = codes_to_text(mapped)
+    assert codes_to_text(unicode_to_codes(text)) == text
+
+def test_cp932_missing():
+    # out of table codes and codes without unicode are -1 / missing, not wrapped to 0xFFFF
+    unmapped = int(np.flatnonzero(codes_to_unicode(np.arange(len(CP932_SJIS))) < 0)[0])
+    out_of_range = [-1, len(CP932_SJIS), 99999]
+    assert codes_to_sjis(out_of_range).tolist() == [-1, -1, -1]
+    assert codes_to_unicode(out_of_range + [unmapped]).tolist() == [-1, -1, -1, -1]
+    assert codes_to_text(out_of_range + [unmapped, 0]) == '\ufffd\ufffd\ufffd\ufffd '
+    assert sjis_to_codes([0x80, 0x10000, -1]).tolist() == [-1, -1, -1]
+    assert unicode_to_codes('\uffff\U0001f600').tolist() == [-1, -1]
+
+
+# shipped FNT4 v0 font used by the tests of font writing
+TEST_FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sample', 'FNT4', 'PCSG00997_FNT4_v0.fnt')
+
+def _test_font_v1() -> Font:
+    # small FNT4 v1 font of random bitmaps for 'A'-'H', other characters share glyph 0 (' ')
+    rand = np.random.default_rng(0)
+    glyphs = {}
+    characters = array('I', [0]) * 0x100
+    for glyph_id, char in enumerate(' ABCDEFGH'):
+        bitmap = rand.integers(0, 256, size=[rand.integers(1, 20), rand.integers(1, 20)], dtype=np.uint8)
+        glyph = GlyphEdit(bitmap, 1, 12, bitmap.shape[1] + 2).apply(
+            LazyGlyph(None, (0, 0), None), ord(char), 1) if False else None
+        data, texture_size = encode_bitmap(bitmap, 1)
+        header = GlyphHeader(None)
+        header.bearing_x, header.bearing_y, header.advance_width = 1, 12, bitmap.shape[1] + 2
+        header.actual_height, header.actual_width = bitmap.shape
+        header.texture_width, header.texture_height = texture_size
+        info = GlyphInfo(header=header, fnt_version=1, chara_index=ord(char))
+        glyphs[glyph_id] = LazyGlyph(info, texture_size, GlyphData(data, False, len(data)))
+        characters[ord(char)] = glyph_id
+    return Font(1, 16, 4, b'', 0, characters, glyphs)
+
+def _test_level0(font: Font, character: int) -> np.ndarray:
+    # mip level 0 of a character without padding
+    glyph = font.glyphs[font.characters[character]]
+    width, height = glyph.info.actual_size()
+    return glyph.decode_level0(font.version)[:height, :width]
+
+def _test_records(font: Font) -> Dict[int, bytes]:
+    # character: stored glyph header and data
+    store = font.glyphs
+    return {character: bytes(store.stored_record(glyph_id)) for character, glyph_id in enumerate(font.characters)}
+
+def test_to_bytes_identical():
+    with open(TEST_FONT_PATH, 'rb') as fp:
+        data = fp.read()
+    assert Font.read(data).to_bytes(workers=1) == data
+    # a new v1 font is compressed once, then copied as is
+    data = _test_font_v1().to_bytes(workers=1)
+    font = Font.read(data)
+    assert font.to_bytes(workers=1) == data
+    assert _test_level0(font, ord('C')).shape == font.glyphs[font.characters[ord('C')]].info.actual_size()[::-1]
+
+def test_patch():
+    for font in (Font.open(TEST_FONT_PATH), Font.read(_test_font_v1().to_bytes(workers=1))):
+        glyph_characters = Counter(font.characters)
+        shared = next(c for c, glyph_id in enumerate(font.characters) if glyph_characters[glyph_id] > 1)
+        unshared = next(c for c, glyph_id in enumerate(font.characters) if glyph_characters[glyph_id] == 1)
+        records = _test_records(font)
+        bitmap = np.zeros([6, 5], dtype=np.uint8)
+        bitmap[1:5, 1:4] = 0xF0  # kept exactly by 4bpp (high nibble)
+        edits = {shared: GlyphEdit(bitmap, bearing_x=2, bearing_y=9, advance_width=7),
+                 unshared: GlyphEdit(advance_width=31)}
+        old_unshared = _test_level0(font, unshared).copy()
+        patched = Font.read(font.repack(edits, workers=1))
+        assert (_test_level0(patched, shared) == bitmap).all()
+        info = patched.glyphs[patched.characters[shared]].info
+        assert (info.bearing_x, info.bearing_y, info.advance_width, info.actual_size()) == (2, 9, 7, (5, 6))
+        info = patched.glyphs[patched.characters[unshared]].info
+        assert info.advance_width == 31 and (_test_level0(patched, unshared) == old_unshared).all()
+        # every other character keeps its glyph record byte for byte
+        new_records = _test_records(patched)
+        for character, record in records.items():
+            if character not in edits:
+                assert new_records[character] == record, f"character {character} changed"
+
+def test_dedup():
+    font = Font.open(TEST_FONT_PATH)
+    glyph_characters = Counter(font.characters)
+    a, b = [c for c, glyph_id in enumerate(font.characters) if glyph_characters[glyph_id] == 1][:2]
+    edit = GlyphEdit(np.full([4, 4], 0xFF, dtype=np.uint8), 0, 4, 5)
+    font.patch({a: edit, b: edit})
+    glyphs = len(font.glyphs)
+    assert font.dedup() == 1
+    assert len(font.glyphs) == glyphs - 1 and font.characters[a] == font.characters[b]
+    deduped = Font.read(font.to_bytes(workers=1))
+    assert deduped.characters[a] == deduped.characters[b]
+    assert len(deduped.glyphs) == glyphs - 1
+
+
+def write_metadata(font: Font, output_path: str):
+    # write the metadata & character mappings to a text file, line by line
+    def glyph_rows():
+        for glyph_id in sorted(font.glyphs.keys()):
+            info = font.glyphs[glyph_id].info
+            yield glyph_id, info.character, info.bearing_x, info.bearing_y, info.advance_width
+    with open(os.path.join(output_path, "metadata.txt"), 'w') as f:
+        write_metadata_lines(f, font.version, font.ascent, font.descent,
+                             enumerate(font.get_character_mapping()), glyph_rows())
+
+
+def gray_to_rgba(gray: np.ndarray) -> np.ndarray:
+    # black pixels with the grayscale value as alpha
+    zeros = np.zeros_like(gray)
+    return np.stack([zeros, zeros, zeros, gray], axis=-1)
+
+
+def export_glyph(font: Font, glyph_id: int, output_path: str, mip_levels=(GlyphMipLevel.Level0,)) -> int:
+    """save mip levels of a glyph as {glyph_id:04}_{unicode/sjis:04x}_{mip}.png, return the number of saved files"""
+    lazy_glyph = font.glyphs[glyph_id]
+    glyph_info = lazy_glyph.info
+    size = glyph_info.actual_size()
+    mip_levels = [GlyphMipLevel(i) for i in mip_levels]
+    arrays = lazy_glyph.decode_arrays(font.version, mip_levels)
+    saved = 0
+    for i in mip_levels:
+        glyph_pixels = arrays[i]
+        if glyph_pixels is None: continue  # FNT4 v0 only has mip level 0
+        glyph_pixels = glyph_pixels[:size[1]//(2**i.value), :size[0]//(2**i.value)]
+        if glyph_pixels.size == 0: continue  # empty glyph, or mip level of a glyph smaller than 2**level
+        new_glyph_pic = Image.fromarray(gray_to_rgba(glyph_pixels), 'RGBA')
+
+        if font.version==1:
+            glyph_pic_name = f"{glyph_id:04}_{glyph_info.unicode:04x}_{i.value}.png"
+        else:
+            glyph_pic_name = f"{glyph_id:04}_{glyph_info.sjis:04x}_{i.value}.png"
+        new_glyph_pic.save(os.path.join(output_path, glyph_pic_name))
+        saved += 1
+    return saved
+
+
+# fonts opened in this (worker) process, font_path: Font
+_EXPORT_FONTS: Dict[str, Font] = {}
+
+def _export_glyphs_chunk(job) -> Tuple[int, int]:
+    # job: (font_path, glyph_ids, output_path, mip_levels), reopen the font in worker instead of pickling it
+    font_path, glyph_ids, output_path, mip_levels = job
+    font = _EXPORT_FONTS.get(font_path)
+    if font is None:
+        font = _EXPORT_FONTS[font_path] = Font.open(font_path)
+    saved = 0
+    for glyph_id in glyph_ids:
+        saved += export_glyph(font, glyph_id, output_path, mip_levels)
+    return len(glyph_ids), saved
+
+
+def export_glyphs(font_path: str, output_path: str, mip_levels=(GlyphMipLevel.Level0,),
+                  character_range: Optional[Tuple[int, int]]=None, workers: Optional[int]=None,
+                  chunk_size: int=64, progress: bool=True) -> Dict[str, float]:
+    """
+    export glyphs of the font at font_path as png files into output_path (same names as export_glyph),
+    glyph ids are split into chunks of chunk_size and exported in a process pool,
+    every worker opens the font (memory-mapped) once by itself.
+    character_range: [start, end) of character codes to export, default all glyphs
+    return the summary: glyphs, files, seconds, glyphs_per_sec
+    """
     os.makedirs(output_path, exist_ok=True)
+    font = Font.open(font_path)
+    if character_range:
+        start, end = character_range
+        glyph_ids = sorted(set(font.characters[start:end]))
+    else:
+        glyph_ids = sorted(font.glyphs.keys())
+    jobs = [(font_path, glyph_ids[i:i+chunk_size], output_path, tuple(mip_levels))
+            for i in range(0, len(glyph_ids), chunk_size)]
+
+    workers = workers or os.cpu_count() or 1
+    done, saved = 0, 0
+    start_time = time.perf_counter()
+    def report(result):
+        nonlocal done, saved
+        done += result[0]
+        saved += result[1]
+        if progress:
+            elapsed = time.perf_counter() - start_time
+            print(f"\r{done}/{len(glyph_ids)} glyphs, {done/elapsed if elapsed else 0:.1f} glyphs/s", end='', flush=True)
+    if workers <= 1 or len(jobs) <= 1:
+        _EXPORT_FONTS[font_path] = font
+        for job in jobs:
+            report(_export_glyphs_chunk(job))
+        _EXPORT_FONTS.pop(font_path)
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            for future in as_completed([pool.submit(_export_glyphs_chunk, job) for job in jobs]):
+                report(future.result())
+    if progress: print()
+    elapsed = time.perf_counter() - start_time
+    return {'glyphs': done, 'files': saved, 'seconds': elapsed, 'glyphs_per_sec': done/elapsed if elapsed else 0.0}
 
-    with open(font_path, 'rb') as fp:
-        font_data = fp.read()
-    font = read_lazy_font(font_data)
 
-    ascent = font.ascent
-    descent = font.descent
+def pack_shelves(sizes: List[Tuple[int, int]], sheet_size: Tuple[int, int], padding: int=1) -> List[Tuple[int, int, int]]:
+    """
+    shelf packer, place rects (width, height) in rows from the tallest one,
+    a row is as tall as its first rect, a new sheet is started when no row fits.
+    return (sheet, x, y) of every rect in the order of sizes
+    """
+    sheet_width, sheet_height = sheet_size
+    places = [None] * len(sizes)
+    sheet, x, y, shelf_height = 0, 0, 0, 0
+    for i in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        width, height = sizes[i]
+        if width + padding > sheet_width or height + padding > sheet_height:
+            raise ValueError(f"rect {width}x{height} is larger than sheet {sheet_width}x{sheet_height}")
+        if x + width + padding > sheet_width:  # next shelf
+            x, y, shelf_height = 0, y + shelf_height, 0
+        if y + height + padding > sheet_height:  # next sheet
+            sheet, x, y, shelf_height = sheet + 1, 0, 0, 0
+        places[i] = (sheet, x, y)
+        x += width + padding
+        shelf_height = max(shelf_height, height + padding)
+    return places
 
+
+def export_atlas(font: Font, output_path: str, mip_level=GlyphMipLevel.Level0,
+                 sheet_size: Tuple[int, int]=(1024, 1024), padding: int=1) -> Dict:
+    """
+    pack all glyphs of a mip level into sprite sheets atlas_{mip}_{n}.png,
+    and write the index atlas_{mip}.json:
+      characters: glyph id of every character code (same as get_character_mapping)
+      glyphs: glyph_id: [sheet, x, y, width, height, bearing_x, bearing_y, advance_width]
+    return the index
+    """
+    mip_level = GlyphMipLevel(mip_level)
+    if font.version==0 and mip_level != GlyphMipLevel.Level0:
+        raise ValueError("FNT4 v0 only has mip level 0")
+    os.makedirs(output_path, exist_ok=True)
+    glyph_ids = sorted(font.glyphs.keys())
+    pixels = []
+    for glyph_id in glyph_ids:
+        width, height = font.glyphs[glyph_id].info.actual_size()
+        glyph_pixels = font.glyphs[glyph_id].decode_arrays(font.version, [mip_level])[mip_level]
+        pixels.append(glyph_pixels[:height >> mip_level.value, :width >> mip_level.value])
+    places = pack_shelves([(p.shape[1], p.shape[0]) for p in pixels], sheet_size, padding)
+
+    sheets = [np.zeros([sheet_size[1], sheet_size[0]], dtype=np.uint8)
+              for _ in range(max((place[0] for place in places), default=-1) + 1)]
+    glyphs = {}
+    for glyph_id, glyph_pixels, (sheet, x, y) in zip(glyph_ids, pixels, places):
+        height, width = glyph_pixels.shape
+        sheets[sheet][y:y+height, x:x+width] = glyph_pixels
+        info = font.glyphs[glyph_id].info
+        glyphs[glyph_id] = [sheet, x, y, width, height, info.bearing_x, info.bearing_y, info.advance_width]
+    sheet_names = []
+    for n, sheet_pixels in enumerate(sheets):
+        sheet_names.append(f"atlas_{mip_level.value}_{n}.png")
+        Image.fromarray(gray_to_rgba(sheet_pixels), 'RGBA').save(os.path.join(output_path, sheet_names[-1]))
+
+    index = {
+        'version': font.version,
+        'ascent': font.ascent,
+        'descent': font.descent,
+        'mip_level': mip_level.value,
+        'sheets': sheet_names,
+        'characters': list(font.get_character_mapping()),
+        'glyphs': glyphs,
+    }
+    with open(os.path.join(output_path, f"atlas_{mip_level.value}.json"), 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    return index
+
+
+def extract(font_path: str, output_path: str, mip_levels=(GlyphMipLevel.Level0,), character_range=None,
+            workers: Optional[int]=None, atlas=False):
+    # metadata.txt and glyph pngs (or atlas sheets) of the font, see fnt4.py extract for the arguments
+    os.makedirs(output_path, exist_ok=True)
+    font = Font.open(font_path)
     # first, write the metadata & character mappings to a text file
-    metadata = []
-    metadata.append(f"ascent: {ascent}")
-    metadata.append(f"descent: {descent}")
-    metadata.append("characters:")
-    for character_code, glyph_id in enumerate(font.get_character_mapping()):
-        metadata.append(f"  {character_code:04x}: {glyph_id:04}")
-    # finally, write the glyph metadata
-    metadata.append("glyphs:")
-    for glyph_id, glyph_data in sorted(font.glyphs.items(), key=lambda v: v[0]):
-        info = glyph_data.info
-        if font.version==0:
-            metadata.append(f"  {glyph_id:04} sjis: {glyph_data.info.sjis:04x}")
-        else:
-            metadata.append(f"  {glyph_id:04} unicode: {glyph_data.info.unicode:04x}")
-        metadata.append(f"    bearing_y: {info.bearing_y}")
-        metadata.append(f"    bearing_x: {info.bearing_x}")
-        metadata.append(f"    advance  : {info.advance_width}")
-    with open(os.path.join(output_path, "metadata.txt"), 'w') as f:
-        f.write("\n".join(metadata))
-    
+    write_metadata(font, output_path)
+    if atlas:
+        for mip in mip_levels:
+            index = export_atlas(font, output_path, mip)
+            print(f"mip {mip}: {len(index['glyphs'])} glyphs in {len(index['sheets'])} sheets")
+        print("Done")
+        return
     # then, save each glyph to a separate file
-    for glyph_id, glyph_data in font.glyphs.items():
-        glyph_info = glyph_data.info
-        size = glyph_info.actual_size()
-        glyph_data = glyph_data.decompress(font.version)
-        # continue
-        for i in GlyphMipLevel:
-            glyph_pic = glyph_data.get_image(i)  # (GlyphMipLevel.Level0)
-            # new_glyph_pic = glyph_pic.convert('LA')
-            new_glyph_pic = Image.new('RGBA', (size[0]//(2**i.value),size[1]//(2**i.value)))
-            for x in range(size[0]//(2**i.value)):
-                for y in range(size[1]//(2**i.value)):
-                    pixel = glyph_pic.getpixel((x, y))  # pixel here same as the grayscale value
-                    new_pixel = (0, 0, 0, pixel)
-                    new_glyph_pic.putpixel((x, y), new_pixel)
-
-            if font.version==1:
-                glyph_pic_name = f"{glyph_id:04}_{glyph_info.unicode:04x}_{i.value}.png"
-            else:
-                glyph_pic_name = f"{glyph_id:04}_{glyph_info.sjis:04x}_{i.value}.png"
-            new_glyph_pic.save(os.path.join(output_path, glyph_pic_name))
-            break  # only save first mip level of the glyph
+    summary = export_glyphs(font_path, output_path, mip_levels, character_range, workers)
+    print(f"{summary['glyphs']} glyphs, {summary['files']} files in {summary['seconds']:.2f}s "
+          f"({summary['glyphs_per_sec']:.1f} glyphs/s)")
     print("Done")
 
+
+def main():
+    # same as fnt4.py extract, the CLI module is only imported here
+    from fnt4 import add_extract_arguments
+    parser = argparse.ArgumentParser(description="extract glyphs and metadata of FNT4 font")
+    add_extract_arguments(parser)
+    args = parser.parse_args()
+    extract(args.font_path, args.output_path, args.mip, args.range, args.workers, args.atlas)
+
 if __name__ == '__main__':
     main()
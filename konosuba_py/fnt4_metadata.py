@@ -0,0 +1,215 @@
+import mmap
+import struct
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, TextIO, Tuple
+
+"""
+Metadata of FNT4 fonts without pixel data, only the standard library (no numpy/PIL),
+so metadata queries start fast and keep memory small.
+
+The character table and glyph headers are read from a memory-mapped file and streamed in glyph_id order
+(order of first appearance in characters table, same as fnt4_extract.Font.read),
+only the map of glyph offsets to glyph_id is kept in memory.
+"""
+
+# SJIS tables
+def _build_cp932_tables() -> Tuple[array, array, array, array]:
+    """
+    tables of FNT4 v0 character code (index of CP932 table):
+    code -> sjis, code -> unicode (0 if cp932 has no such character),
+    and the reverse sjis -> code, unicode -> code of 0x10000 entries (-1 if no such code)
+    """
+    code_sjis = array('H', range(0x20, 0x7F+0x1))  # single byte
+    code_sjis.extend(range(0xa0, 0xdf+0x1))
+    # double byte sjis, 0x7f is never a trail byte, 0xe0-0xee contain NEC ext-range
+    for high_byte in (*range(0x81, 0x9f+0x1), *range(0xe0, 0xee+0x1)):
+        code_sjis.extend(sjis for sjis in range((high_byte<<8)+0x40, (high_byte<<8)+0xFC+0x1) if sjis&0xff != 0x7f)
+    code_unicode = array('H', bytes(2*len(code_sjis)))
+    sjis_code = array('i', [-1]) * 0x10000
+    unicode_code = array('i', [-1]) * 0x10000
+    for code, sjis in enumerate(code_sjis):
+        sjis_code[sjis] = code
+        try:
+            char = sjis.to_bytes(2 if sjis > 0xFF else 1, 'big').decode('cp932')
+        except UnicodeDecodeError:
+            continue
+        if len(char) == 1:
+            code_unicode[code] = ord(char)
+            if unicode_code[ord(char)] < 0:  # NEC duplicates, keep the first code
+                unicode_code[ord(char)] = code
+    return code_sjis, code_unicode, sjis_code, unicode_code
+
+CP932_SJIS, CP932_UNICODE, SJIS_CP932, UNICODE_CP932 = _build_cp932_tables()
+
+
+def map_sjis(sjis_codepoint: int):
+    # sjis of a FNT4 v0 character code, None if out of CP932 table
+    if 0 <= sjis_codepoint < len(CP932_SJIS):
+        return CP932_SJIS[sjis_codepoint]
+    return None
+
+
+# struct of FontHeader and GlyphHeader, fnt_version: struct
+HEADER_STRUCTS = {
+    1: struct.Struct('<4s2I2H'),  # magic, version, fsize, ascent, descent
+    0: struct.Struct('<4sI2HI'),  # magic, fsize, ascent, descent, padding
+}
+GLYPH_HEADER_STRUCTS = {
+    1: struct.Struct('<2b6BH'),  # bearing_x, bearing_y, actual_width, actual_height, advance_width, unused, texture_width, texture_height, compressed_size
+    0: struct.Struct('<2b4BH'),  # bearing_x, bearing_y, actual_width, actual_height, advance_width, unknow, compressed_size
+}
+
+
+@dataclass
+class FontMetadata:
+    version: int
+    fsize: int
+    ascent: int
+    descent: int
+    character_size: int  # entries of characters table
+
+
+@dataclass
+class GlyphMetrics:
+    glyph_id: int
+    offset: int
+    character: int  # the first character code use this glyph (unicode in FNT4 v1, index of CP932 table in v0)
+    bearing_x: int
+    bearing_y: int
+    actual_width: int
+    actual_height: int
+    advance_width: int
+    texture_width: int  # actual size in FNT4 v0
+    texture_height: int
+    compressed_size: int  # 0 if stored uncompressed
+
+    def uncompressed_size(self, fnt_version) -> int:
+        if fnt_version==1:
+            initial_mip_size = self.texture_width * self.texture_height
+            return initial_mip_size + (initial_mip_size//4) + (initial_mip_size//16) + (initial_mip_size//64)
+        return (self.actual_width + 1) // 2 * self.actual_height
+
+
+def read_metadata(data) -> FontMetadata:
+    if data[0x4:0x8]==b"\x01\x00\x00\x00":
+        magic, version, fsize, ascent, descent = HEADER_STRUCTS[1].unpack_from(data, 0)
+    elif data[0xC:0x10]==b"\x00\x00\x00\x00":
+        magic, fsize, ascent, descent, _ = HEADER_STRUCTS[0].unpack_from(data, 0)
+        version = 0
+    else:
+        raise Exception("unknown version in header part")
+    assert magic == b"FNT4", f"Invalid magic number: {magic}"
+    if fsize != len(data):
+        raise ValueError(f"Font size in header does not match actual stream size")
+    character_size = (struct.unpack_from('<I', data, 0x10)[0]-0x10) // 4
+    return FontMetadata(version, fsize, ascent, descent, character_size)
+
+
+def iter_characters(data, metadata: FontMetadata, glyph_ids: Dict[int, int]) -> Iterator[Tuple[int, int]]:
+    """
+    (character code, glyph_id) of every entry of characters table,
+    glyph_ids (glyph offset: glyph_id) is filled with new glyphs as they appear
+    """
+    table = memoryview(data)[0x10:0x10+4*metadata.character_size]
+    for character_code, (offset,) in enumerate(struct.iter_unpack('<I', table)):
+        glyph_id = glyph_ids.get(offset)
+        if glyph_id is None:
+            glyph_id = glyph_ids[offset] = len(glyph_ids)
+        yield character_code, glyph_id
+
+
+def iter_glyphs(data, metadata: FontMetadata, glyph_ids: Optional[Dict[int, int]] = None) -> Iterator[GlyphMetrics]:
+    """GlyphMetrics in glyph_id order, glyph_ids: the filled map of iter_characters, read the characters table if None"""
+    if glyph_ids is None:
+        glyph_ids = {}
+        for _ in iter_characters(data, metadata, glyph_ids):
+            pass
+    next_glyph_id = 0  # glyph_id increase with first appearance, so a smaller one is a seen glyph
+    table = memoryview(data)[0x10:0x10+4*metadata.character_size]
+    header_struct = GLYPH_HEADER_STRUCTS[metadata.version]
+    for character_code, (offset,) in enumerate(struct.iter_unpack('<I', table)):
+        glyph_id = glyph_ids[offset]
+        if glyph_id < next_glyph_id:
+            continue
+        next_glyph_id += 1
+        if metadata.version==1:
+            bearing_x, bearing_y, actual_width, actual_height, advance_width, _, texture_width, texture_height, \
+                compressed_size = header_struct.unpack_from(data, offset)
+        else:
+            bearing_x, bearing_y, actual_width, actual_height, advance_width, _, compressed_size = \
+                header_struct.unpack_from(data, offset)
+            texture_width, texture_height = actual_width, actual_height
+        yield GlyphMetrics(glyph_id, offset, character_code, bearing_x, bearing_y, actual_width, actual_height,
+                           advance_width, texture_width, texture_height, compressed_size)
+
+
+def open_font_data(path: str) -> memoryview:
+    # read-only memory map of the font file
+    with open(path, 'rb') as fp:
+        return memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def write_metadata_lines(out: TextIO, fnt_version, ascent: int, descent: int,
+                         characters: Iterator[Tuple[int, int]], glyphs: Iterator[Tuple[int, int, int, int, int]]) -> None:
+    """
+    write metadata.txt format line by line,
+    characters: (character code, glyph_id), glyphs: (glyph_id, character code, bearing_x, bearing_y, advance_width)
+    """
+    out.write(f"ascent: {ascent}\n")
+    out.write(f"descent: {descent}\n")
+    out.write("characters:")
+    for character_code, glyph_id in characters:
+        out.write(f"\n  {character_code:04x}: {glyph_id:04}")
+    out.write("\nglyphs:")
+    for glyph_id, character_code, bearing_x, bearing_y, advance_width in glyphs:
+        if fnt_version==0:
+            out.write(f"\n  {glyph_id:04} sjis: {map_sjis(character_code):04x}")
+        else:
+            out.write(f"\n  {glyph_id:04} unicode: {character_code:04x}")
+        out.write(f"\n    bearing_y: {bearing_y}")
+        out.write(f"\n    bearing_x: {bearing_x}")
+        out.write(f"\n    advance  : {advance_width}")
+
+
+def write_metadata(path: str, out: TextIO) -> None:
+    """stream metadata.txt of font file at path to out, same as fnt4_extract.write_metadata"""
+    data = open_font_data(path)
+    metadata = read_metadata(data)
+    glyph_ids = {}
+    write_metadata_lines(out, metadata.version, metadata.ascent, metadata.descent,
+                         iter_characters(data, metadata, glyph_ids),
+                         ((glyph.glyph_id, glyph.character, glyph.bearing_x, glyph.bearing_y, glyph.advance_width)
+                          for glyph in iter_glyphs(data, metadata, glyph_ids)))
+
+
+def font_info(path: str) -> Dict:
+    """summary of font file at path: header, characters, glyphs and sizes of glyph data"""
+    data = open_font_data(path)
+    metadata = read_metadata(data)
+    glyphs = compressed_glyphs = compressed_bytes = uncompressed_bytes = 0
+    max_width = max_height = 0
+    for glyph in iter_glyphs(data, metadata):
+        glyphs += 1
+        uncompressed_size = glyph.uncompressed_size(metadata.version)
+        uncompressed_bytes += uncompressed_size
+        if glyph.compressed_size:
+            compressed_glyphs += 1
+            compressed_bytes += glyph.compressed_size
+        else:
+            compressed_bytes += uncompressed_size
+        max_width = max(max_width, glyph.actual_width)
+        max_height = max(max_height, glyph.actual_height)
+    return {
+        'version': metadata.version,
+        'fsize': metadata.fsize,
+        'ascent': metadata.ascent,
+        'descent': metadata.descent,
+        'characters': metadata.character_size,
+        'glyphs': glyphs,
+        'compressed_glyphs': compressed_glyphs,
+        'glyph_data_bytes': compressed_bytes,
+        'uncompressed_bytes': uncompressed_bytes,
+        'ratio': compressed_bytes / uncompressed_bytes if uncompressed_bytes else 0.0,
+        'max_glyph_size': [max_width, max_height],
+    }
@@ -0,0 +1,140 @@
+import threading
+from collections import Counter
+from typing import Dict, List, Tuple
+
+"""
+Opt-in statistics of reading and decoding FNT4 fonts, to profile slow fonts and tune the lz77 compressor.
+
+Pass a FontStats to Font.read/Font.open (stats=...), and a CodecStats to lz77.decompress/lz77.compress,
+nothing is counted or timed when no stats is given.
+All record methods are thread-safe, report() returns a json-friendly dict.
+"""
+
+# unicode range of the CJK glyphs counted in cjk_advance_width/cjk_bearing
+CJK_RANGE = (19968, 40959)
+# debug result of CJK glyphs in the v1 sample
+# cjk_advance_width = {48}
+# cjk_bearing = {(-8, 32), (-8, 48), (-8, 56), (-16, 48), (-16, 56), (-8, 40)}
+
+
+class CodecStats:
+    """counters of lz77 streams, compressed/uncompressed are the sizes of both sides whichever the direction"""
+    def __init__(self):
+        self.streams = 0
+        self.compressed_bytes = 0
+        self.uncompressed_bytes = 0
+        self.literals = 0
+        self.references = 0
+        self.match_bytes = 0  # output bytes of all back-references
+        self.match_lengths = Counter()  # length of back-reference: count
+        self.match_offsets = Counter()  # offset of back-reference: count
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, compressed_bytes: int, uncompressed_bytes: int, literals: int,
+               match_lengths: Counter, match_offsets: Counter, seconds: float) -> None:
+        with self._lock:
+            self.streams += 1
+            self.compressed_bytes += compressed_bytes
+            self.uncompressed_bytes += uncompressed_bytes
+            self.literals += literals
+            self.references += sum(match_lengths.values())
+            self.match_bytes += sum(length * count for length, count in match_lengths.items())
+            self.match_lengths.update(match_lengths)
+            self.match_offsets.update(match_offsets)
+            self.seconds += seconds
+
+    def average_match_length(self) -> float:
+        return self.match_bytes / self.references if self.references else 0.0
+
+    def ratio(self) -> float:
+        # compressed / uncompressed, smaller is better
+        return self.compressed_bytes / self.uncompressed_bytes if self.uncompressed_bytes else 0.0
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {
+                'streams': self.streams,
+                'compressed_bytes': self.compressed_bytes,
+                'uncompressed_bytes': self.uncompressed_bytes,
+                'ratio': self.ratio(),
+                'literals': self.literals,
+                'references': self.references,
+                'average_match_length': self.average_match_length(),
+                'match_lengths': dict(sorted(self.match_lengths.items())),
+                'match_offsets': dict(sorted(self.match_offsets.items())),
+                'seconds': self.seconds,
+                'mb_per_sec': self.uncompressed_bytes / self.seconds / 1e6 if self.seconds else 0.0,
+            }
+
+
+class FontStats:
+    """
+    metric histograms of the glyphs of a font, the decode time of every glyph
+    and the lz77 counters of those decodes (decode)
+    """
+    def __init__(self):
+        self.glyphs = 0
+        self.advance_width = Counter()  # advance_width: glyphs
+        self.bearing = Counter()  # (bearing_x, bearing_y): glyphs
+        self.texture_size = Counter()  # (width, height): glyphs
+        self.cjk_advance_width = Counter()  # same as above, only CJK glyphs of FNT4 v1
+        self.cjk_bearing = Counter()
+        self.decode_seconds: Dict[int, float] = {}  # glyph_id: seconds of its last decompression
+        self.decode = CodecStats()
+        self._lock = threading.Lock()
+
+    def record_table(self, table) -> None:
+        # metrics of every glyph in a GlyphTable
+        bearings = list(zip(table.bearing_x.tolist(), table.bearing_y.tolist()))
+        advance_widths = table.advance_width.tolist()
+        texture_sizes = zip(table.texture_width.tolist(), table.texture_height.tolist())
+        with self._lock:
+            self.glyphs += len(table)
+            self.advance_width.update(advance_widths)
+            self.bearing.update(bearings)
+            self.texture_size.update(texture_sizes)
+            if table.version == 1:
+                for character, advance_width, bearing in zip(table.character.tolist(), advance_widths, bearings):
+                    if CJK_RANGE[0] <= character <= CJK_RANGE[1]:
+                        self.cjk_advance_width[advance_width] += 1
+                        self.cjk_bearing[bearing] += 1
+
+    def record_glyph(self, info, texture_size: Tuple[int, int], character: int) -> None:
+        # metrics of one glyph, character is unicode in FNT4 v1 (None in v0)
+        bearing = (info.bearing_x, info.bearing_y)
+        with self._lock:
+            self.glyphs += 1
+            self.advance_width[info.advance_width] += 1
+            self.bearing[bearing] += 1
+            self.texture_size[tuple(texture_size)] += 1
+            if character is not None and CJK_RANGE[0] <= character <= CJK_RANGE[1]:
+                self.cjk_advance_width[info.advance_width] += 1
+                self.cjk_bearing[bearing] += 1
+
+    def record_decode(self, glyph_id: int, seconds: float) -> None:
+        with self._lock:
+            self.decode_seconds[glyph_id] = seconds
+
+    def slowest(self, n: int = 10) -> List[Tuple[int, float]]:
+        # (glyph_id, seconds) of the n slowest decoded glyphs
+        with self._lock:
+            return sorted(self.decode_seconds.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def report(self) -> Dict:
+        def histogram(counter):
+            return {str(key): count for key, count in sorted(counter.items())}
+        with self._lock:
+            result = {
+                'glyphs': self.glyphs,
+                'advance_width': histogram(self.advance_width),
+                'bearing': histogram(self.bearing),
+                'texture_size': histogram(self.texture_size),
+                'cjk_advance_width': histogram(self.cjk_advance_width),
+                'cjk_bearing': histogram(self.cjk_bearing),
+                'decoded_glyphs': len(self.decode_seconds),
+                'decode_seconds': sum(self.decode_seconds.values()),
+            }
+        result['slowest'] = self.slowest()
+        result['decode'] = self.decode.report()
+        return result
@@ -1,4 +1,7 @@
-import io
+import time
+import random
+from collections import Counter
+from enum import IntEnum
 '''
 Implement the LZ77 variant used in the game.
 This variant of LZ77 precedes a block of data with an 8-bit bitmap specifying whether decompressor should read a literal byte or a reference.
@@ -17,173 +20,229 @@ https://gitlab.com/Neurochitin/kaleido/-/tree/saku/fnt
 '''
 
 
-def decompress(input_data: bytes, seek_bits: int, backseek_nbyte: int) -> bytes:
-    input_stream = io.BytesIO(input_data)
-    output = io.BytesIO()
+def decompress(input_data: bytes, seek_bits: int, backseek_nbyte: int, out_size: int = 0, out_limit: int = 0,
+               stats=None) -> bytes:
+    # out_size: the known decompressed length (e.g. uncompressed_size of glyph), output buffer will allocate once if given
+    # out_limit: stop decompressing once out_limit bytes are output (e.g. only the first mip level), return those bytes only
+    # stats: font_stats.CodecStats to record this stream in, the tokens are counted in a second pass so None costs nothing
+    start_time = time.perf_counter() if stats is not None else 0.0
+    if backseek_nbyte==2:  # FNT4 v1 use
+        offset_bits = seek_bits
+        back_offset_mask = (1 << offset_bits) - 1  # magic to get the last OFFSET_BITS bits
+    elif backseek_nbyte==1:  # FNT4 v0 use
+        len_bits = seek_bits
+        back_len_mask = (1 << len_bits) - 1  # magic to get the last LEN_BITS bits
+    else:
+        raise Exception(f"unknown backseek nbyte:{backseek_nbyte}")
 
-    while input_stream.tell() < len(input_data):
-        map_byte = input_stream.read(1)
+    input_len = len(input_data)
+    output = bytearray(out_size)
+    in_pos, out_pos = 0, 0
+    while in_pos < input_len:
+        if out_limit and out_pos >= out_limit: break
+        map_byte = input_data[in_pos]
+        in_pos += 1
         for i in range(8):
-            if input_stream.tell() >= len(input_data): break
-            if ((map_byte[0] >> i) & 1) == 0: # direct byte output
-                # if input_stream.tell() >= len(input_data): break  # sometimes no other bytes in the end
+            if in_pos >= input_len: break
+            if ((map_byte >> i) & 1) == 0: # direct byte output
                 # literal value
-                output.write(input_stream.read(1))
-            else:
-                # back seek
-                backseek_spec = int.from_bytes(input_stream.read(backseek_nbyte), 'big', signed=False)  # big endian Oo
-                '''
-                FNT4 v0
-                MSB  XXXXXXXX          YYYYYYYY    LSB
-                val  backOffset        len
-                size (8-LEN_BITS)      LEN_BITS
-                
-                FNT4 v1
-                MSB  XXXXXXXX          YYYYYYYY    LSB
-                val  len               backOffset
-                size (16-OFFSET_BITS)  OFFSET_BITS
-                '''
-                if backseek_nbyte==2:  # FNT4 v1 use
-                    offset_bits = seek_bits
-                    back_offset_mask = (1 << offset_bits) - 1  # magic to get the last OFFSET_BITS bits
-                    back_length = (backseek_spec >> offset_bits) + 3
-                    back_offset = (backseek_spec & back_offset_mask) + 1
-                elif backseek_nbyte==1:  # FNT4 v0 use
-                    len_bits = seek_bits
-                    back_len_mask = (1 << len_bits) - 1  # magic to get the last LEN_BITS bits
-                    back_length = (backseek_spec & back_len_mask) + 2
-                    back_offset = (backseek_spec >> len_bits) + 1
-                else:
-                    raise Exception(f"unknown backseek nbyte:{backseek_nbyte}")
-
-                for _ in range(back_length):  # push char to output one by one
-                    last = output.tell() - back_offset
-                    assert last >= 0
-                    # TODO: make this fallible?
-                    # TODO: this might be optimized by stopping the bounds checking after we have enough data to guarantee that it's in bounds
-                    output.write(bytes([output.getbuffer()[last]]))
-    return output.getvalue()
-
-
-def compress(input_bytes: bytes, offset_bits:int=10) -> bytes:
-    # just implement FNT4-v1 format yet, FNT4-v0 future maybe
-    count_bits = (16-offset_bits)
-    max_count = (1 << count_bits) - 1 + 3  # max_count as look_ahead_buf_len
-    max_offset = (1 << offset_bits) - 1 + 1  # max_offset as search_buf_len
-
-    def find_offset(search_bytes: bytes, map_bytes: bytes):
-        for i in range(len(search_bytes)):
-            if search_bytes[-(i+1)]==map_bytes[0] and\
-                  search_bytes[-(i+1):].startswith(map_bytes):
-                return i+1
-        else:
-            raise Exception('err')
-
-    def all_the_same(input_list, compare):
-            for item in input_list:
-                if compare != item:
-                    return False
-            return True
-    
-    # first, map all input bytes to instruction format
-    instructions = [input_bytes[0]]
-    log_len = 1  # a length to logging how many input_bytes already encode
-    map_bytes = []  # a look ahead window to logging already mapping bytes
-    search_buf, len_offset = None, None  # encode to instruction: [len,offset]
-    i = 1
-    while i < len(input_bytes):
-        log_bytes = input_bytes[:log_len]
-        # map byte in look ahead buf
-        if map_bytes:
-            if len_offset[0]==len_offset[1] and\
-                    input_bytes[i]==map_bytes[0]:
-                # add sub-map routine, when (new byte*N) == map_bytes[:N]
-                main_map_len = len(map_bytes)
-                sub_map_len = main_map_len
-                sub_pos = i
-                while (max_count-len(map_bytes))>0:
-                    if (max_count-len(map_bytes))<main_map_len:
-                        sub_map_len = (max_count-len(map_bytes))
-                    if input_bytes[sub_pos:(sub_pos+sub_map_len)] != bytes(map_bytes[:sub_map_len]):
-                        break
-                    map_bytes.extend(map_bytes[:sub_map_len])
-                    sub_pos += sub_map_len
-                # if still has some bytes can't map the map_bytes[:main_map_len]
-                if len(map_bytes)<max_count:
-                    for j in range(len(map_bytes),0,-1):
-                        if input_bytes[sub_pos:sub_pos+j] == bytes(map_bytes[:j]):
-                            # finded part of main_map
-                            map_bytes.extend(map_bytes[:j])
-                            sub_pos += j
-                            break
-                i = sub_pos
-                len_offset[0] = len(map_bytes)
-                # at this time, only full of max_count will save
-                if len_offset[0]==max_count or i==len(input_bytes): #>len_offset[1]:
-                    if 0<len(map_bytes)<3:
-                        if len_offset[0]==2:
-                            if all_the_same(map_bytes,map_bytes[0]) and len_offset[1]==1:
-                                instructions.extend(map_bytes)
-                        else:
-                            raise Exception('usually will not run in here,please debug')
-                    else:
-                        instructions.append(len_offset)
-                    log_len += len(map_bytes)
-                    map_bytes = []
-                    search_buf, len_offset = None, None
-                    continue
-            if bytes(map_bytes+[input_bytes[i]]) not in search_buf:
-                if 0<len(map_bytes)<3:
-                    if len(map_bytes)==2 and \
-                        (not all_the_same(map_bytes,map_bytes[0]) or\
-                            bytes([map_bytes[1],input_bytes[i]]) in search_buf):
-                        # dont known why but:
-                        # 1. look ahead (m n h), if (m n) find in search_buf but (m n h) not find, 
-                        # 2. look ahead (m m h), if (m m) find in search_buf but (m m h) not find but (m h) find,
-                        # those look ahead pos should -1
-                        map_bytes = map_bytes[:1]
-                        i -= 1
-                    instructions.extend(map_bytes)
+                if out_pos < len(output):
+                    output[out_pos] = input_data[in_pos]
                 else:
-                    len_offset[0] = len(map_bytes)
-                    if len_offset[0]==2:
-                        raise Exception('usually will not run in here,please debug')
-                    instructions.append(len_offset)
-                log_len += len(map_bytes)
-                map_bytes = []
-                search_buf = None    
-                len_offset = None
+                    output.append(input_data[in_pos])
+                in_pos += 1
+                out_pos += 1
+                continue
+            # back seek
+            '''
+            FNT4 v0
+            MSB  XXXXXXXX          YYYYYYYY    LSB
+            val  backOffset        len
+            size (8-LEN_BITS)      LEN_BITS
+            
+            FNT4 v1
+            MSB  XXXXXXXX          YYYYYYYY    LSB
+            val  len               backOffset
+            size (16-OFFSET_BITS)  OFFSET_BITS
+            '''
+            if backseek_nbyte==2:
+                backseek_spec = (input_data[in_pos] << 8) | input_data[in_pos+1]  # big endian Oo
+                back_length = (backseek_spec >> offset_bits) + 3
+                back_offset = (backseek_spec & back_offset_mask) + 1
             else:
-                if len(map_bytes)==max_count:
-                    len_offset = [len(map_bytes),find_offset(search_buf,bytes(map_bytes))]
-                    instructions.append(len_offset)
-                    log_len += len(map_bytes)
-                    map_bytes = []
-                    search_buf = None
-                else:
-                    map_bytes.append(input_bytes[i])
-                    len_offset = [len(map_bytes),find_offset(search_buf,bytes(map_bytes))]
-                    # already look all input
-                    if (i+1)==len(input_bytes):
-                        if len_offset[0]<3:
-                            instructions.extend(map_bytes)
-                        else:
-                            instructions.append(len_offset)
-                        log_len += len(map_bytes)
-                    i += 1
-        else:
-            # if no map, first find next search_buf
-            if not search_buf:
-                search_buf = log_bytes[-(max_offset):] if len(log_bytes)>1023 else log_bytes
-            if bytes([input_bytes[i]]) in search_buf and (i+1)!=len(input_bytes):
-                map_bytes.append(input_bytes[i])
-                len_offset = [1,find_offset(search_buf,bytes(map_bytes))]
+                backseek_spec = input_data[in_pos]
+                back_length = (backseek_spec & back_len_mask) + 2
+                back_offset = (backseek_spec >> len_bits) + 1
+            in_pos += backseek_nbyte
+
+            last = out_pos - back_offset
+            assert last >= 0, f"back seek out of range: offset {back_offset} at {out_pos}"
+            if back_offset >= back_length:
+                # no overlap, copy the whole reference as one slice
+                output[out_pos:out_pos+back_length] = output[last:last+back_length]
+            else:
+                # overlap, reference repeats the last back_offset bytes,
+                # copy it chunk by chunk (the chunk grows as the run already copied gets longer)
+                end = out_pos + back_length
+                pos = out_pos
+                while pos < end:
+                    chunk = min(pos - last, end - pos)
+                    output[pos:pos+chunk] = output[last:last+chunk]
+                    pos += chunk
+            out_pos += back_length
+    if out_limit and out_pos > out_limit:
+        out_pos = out_limit
+    if out_pos < len(output):
+        del output[out_pos:]  # stream shorter than out_size
+    if stats is not None:
+        record_decompress(stats, input_data, seek_bits, backseek_nbyte, out_limit, out_pos,
+                          time.perf_counter() - start_time)
+    return bytes(output)
+
+
+def record_decompress(stats, input_data: bytes, seek_bits: int, backseek_nbyte: int, out_limit: int,
+                      output_size: int, seconds: float) -> None:
+    # record a decompressed stream in stats (font_stats.CodecStats), seconds: the decode time measured before counting
+    literals, match_lengths, match_offsets, in_pos = count_tokens(input_data, seek_bits, backseek_nbyte, out_limit)
+    stats.record(in_pos, output_size, literals, match_lengths, match_offsets, seconds)
+
+
+def count_tokens(input_data: bytes, seek_bits: int, backseek_nbyte: int, out_limit: int = 0):
+    '''
+    walk the tokens of a compressed stream without output, same stop rule as decompress,
+    return (literals, Counter of reference lengths, Counter of reference offsets, input bytes read)
+    '''
+    literals = 0
+    match_lengths, match_offsets = Counter(), Counter()
+    input_len = len(input_data)
+    in_pos, out_pos = 0, 0
+    while in_pos < input_len:
+        if out_limit and out_pos >= out_limit: break
+        map_byte = input_data[in_pos]
+        in_pos += 1
+        for i in range(8):
+            if in_pos >= input_len: break
+            if ((map_byte >> i) & 1) == 0:
+                literals += 1
+                in_pos += 1
+                out_pos += 1
+                continue
+            if backseek_nbyte==2:
+                backseek_spec = (input_data[in_pos] << 8) | input_data[in_pos+1]
+                back_length = (backseek_spec >> seek_bits) + 3
+                back_offset = (backseek_spec & ((1 << seek_bits) - 1)) + 1
             else:
-                instructions.append(input_bytes[i])
-                log_len += 1
-                search_buf = None
+                backseek_spec = input_data[in_pos]
+                back_length = (backseek_spec & ((1 << seek_bits) - 1)) + 2
+                back_offset = (backseek_spec >> seek_bits) + 1
+            in_pos += backseek_nbyte
+            match_lengths[back_length] += 1
+            match_offsets[back_offset] += 1
+            out_pos += back_length
+    return literals, match_lengths, match_offsets, min(in_pos, input_len)
+
+
+class CompressLevel(IntEnum):
+    '''effort of the match finder in compress'''
+    Greedy = 0  # take the first good match of a short hash chain
+    Lazy = 1  # also try the match at next byte, emit a literal if that one is longer
+    Deep = 2  # lazy and walk the whole hash chain (whole window)
+
+# max candidates visited in one hash chain for every level
+CHAIN_DEPTH = {
+    CompressLevel.Greedy: 8,
+    CompressLevel.Lazy: 32,
+    CompressLevel.Deep: 1 << 16,
+}
+
+
+def compress(input_bytes: bytes, seek_bits: int=10, backseek_nbyte: int=2, level: CompressLevel=CompressLevel.Lazy,
+             stats=None) -> bytes:
+    '''
+    seek_bits, backseek_nbyte: same as decompress, (10, 2) for FNT4 v1 and (3, 1) for FNT4 v0
+    level: see CompressLevel
+    stats: font_stats.CodecStats to record this stream in (literals, reference lengths/offsets, ratio, time)
+
+    Matches are searched by hash chains: every position is linked to the previous position
+    that starts with the same *min_count* bytes, so only those candidates in the window are compared.
+    '''
+    if backseek_nbyte==2:  # FNT4 v1 use
+        offset_bits = seek_bits
+        count_bits = (16-offset_bits)
+        min_count = 3
+        max_count = (1 << count_bits) - 1 + 3  # max_count as look_ahead_buf_len
+        max_offset = (1 << offset_bits) - 1 + 1  # max_offset as search_buf_len
+    elif backseek_nbyte==1:  # FNT4 v0 use
+        len_bits = seek_bits
+        min_count = 2
+        max_count = (1 << len_bits) - 1 + 2
+        max_offset = (1 << (8-len_bits)) - 1 + 1
+    else:
+        raise Exception(f"unknown backseek nbyte:{backseek_nbyte}")
+    chain_depth = CHAIN_DEPTH[CompressLevel(level)]
+    start_time = time.perf_counter() if stats is not None else 0.0
+    lazy = level != CompressLevel.Greedy
+
+    data = bytes(input_bytes)
+    data_len = len(data)
+    head = {}  # first min_count bytes -> last position start with them
+    prev = [-1] * data_len  # position -> previous position with same first min_count bytes
+
+    def insert(pos):
+        key = data[pos:pos+min_count]
+        prev[pos] = head.get(key, -1)
+        head[key] = pos
+
+    def find_match(pos):
+        # return (count, offset) of the longest match start at pos, count is 0 if no match
+        limit = min(max_count, data_len - pos)
+        if limit < min_count:
+            return 0, 0
+        best_count, best_offset = 0, 0
+        cand = head.get(data[pos:pos+min_count], -1)
+        depth = chain_depth
+        while cand >= 0 and pos - cand <= max_offset and depth > 0:
+            depth -= 1
+            # only compare the rest bytes when this candidate can be longer than best one
+            if best_count == 0 or (data[cand+best_count] == data[pos+best_count] and
+                    data[cand:cand+best_count] == data[pos:pos+best_count]):
+                count = min_count
+                while count < limit and data[cand+count] == data[pos+count]:
+                    count += 1  # can overlap current pos, decompress handle it
+                if count > best_count:
+                    best_count, best_offset = count, pos - cand
+                    if count == limit: break
+            cand = prev[cand]
+        return best_count, best_offset
+
+    # first, map all input bytes to instruction format: int for literal, [count, offset] for reference
+    instructions = []
+    i = 0
+    match = None
+    while i < data_len:
+        if match is None:
+            match = find_match(i)
+        insert(i)
+        count, offset = match
+        if count == 0:
+            instructions.append(data[i])
             i += 1
-    
+            match = None
+            continue
+        if lazy and count < max_count and i + 1 < data_len:
+            next_match = find_match(i + 1)
+            if next_match[0] > count:
+                # longer match at next byte, output this one as literal
+                instructions.append(data[i])
+                i += 1
+                match = next_match
+                continue
+        instructions.append([count, offset])
+        for pos in range(i + 1, i + count):
+            insert(pos)
+        i += count
+        match = None
+
     # next encode all instructions to compress bytes
     slices = []
     for i in range(0, len(instructions), 8):
@@ -196,21 +255,84 @@ def compress(input_bytes: bytes, offset_bits:int=10) -> bytes:
                 # some raise for debug
                 if count > max_count:
                     raise ValueError(f"count too high ({count} > {max_count})")
-                if count < 3:
-                    raise ValueError(f"count too low ({count} < 3)")
+                if count < min_count:
+                    raise ValueError(f"count too low ({count} < {min_count})")
                 if offset > max_offset:
                     raise ValueError(f"offset too high ({offset} > {max_offset})")
                 if offset <= 0:
                     raise ValueError(f"offset too low ({offset} <= 0)")
-                len_b = ((count - 3) << (8-count_bits)) | ((offset-1) >> 8)
-                offset_b = (offset-1) & 0xff  # bitwise-AND with 8-bits offset_mask
-                bytes_.extend([len_b, offset_b])
+                if backseek_nbyte==2:
+                    len_b = ((count - 3) << (8-count_bits)) | ((offset-1) >> 8)
+                    offset_b = (offset-1) & 0xff  # bitwise-AND with 8-bits offset_mask
+                    bytes_.extend([len_b, offset_b])
+                else:
+                    bytes_.append(((offset-1) << len_bits) | (count - 2))
             else:
                 if e > 255 or e < 0:  # raise for debug
                     raise ValueError(f"Byte out of range ({e})")
                 bytes_.append(e)
         slices.extend([bitmap_marker, *bytes_])
-    
+
+    if stats is not None:
+        references = [e for e in instructions if isinstance(e, list)]
+        stats.record(len(slices), data_len, len(instructions) - len(references),
+                     Counter(count for count, _ in references), Counter(offset for _, offset in references),
+                     time.perf_counter() - start_time)
     return bytes(slices)
 
 # result = decompress(b'\xc0HELLO 0\x05\x80\x0b',12)
+
+
+def _test_inputs(seed: int=0):
+    # random bytes, runs (long overlapping references) and mixes of both, also the empty and short edge cases
+    rand = random.Random(seed)
+    inputs = [b'', b'a', b'ab', b'abc', b'\x00' * 5000]
+    for size in [1, 2, 3, 4, 7, 17, 100, 1000, 4096]:
+        inputs.append(rand.randbytes(size))
+        inputs.append(bytes(rand.choice(b'\x00\x00\x00\xff\x80') for _ in range(size)))
+        inputs.append(b''.join(bytes([rand.randrange(256)]) * rand.randrange(1, 40) for _ in range(size // 8 + 1)))
+        inputs.append(bytes(rand.randrange(4) for _ in range(size)))  # few symbols, many short matches
+    return inputs
+
+# (seek_bits, backseek_nbyte) of FNT4 v1, FNT4 v0 and two other splits of the reference bits
+TEST_PARAMS = [(10, 2), (3, 1), (12, 2), (4, 1)]
+
+def test_known_streams():
+    # literals 'ab' and a reference of length 4 at offset 2
+    assert decompress(b'\x04ab\x04\x01', 10, 2) == b'ababab'
+    assert decompress(b'\x04ab\x0a', 3, 1) == b'ababab'
+
+def test_roundtrip():
+    for seek_bits, backseek_nbyte in TEST_PARAMS:
+        for data in _test_inputs():
+            for level in CompressLevel:
+                compressed = compress(data, seek_bits, backseek_nbyte, level)
+                result = decompress(compressed, seek_bits, backseek_nbyte)
+                assert result == data, f"round-trip differs: {len(data)} bytes, {(seek_bits, backseek_nbyte)}, {level.name}"
+                assert decompress(compressed, seek_bits, backseek_nbyte, len(data)) == data
+
+def test_out_size_and_limit():
+    for seek_bits, backseek_nbyte in TEST_PARAMS:
+        for data in _test_inputs(1):
+            compressed = compress(data, seek_bits, backseek_nbyte)
+            # out_size is only a hint, a wrong one still gives the whole stream
+            assert decompress(compressed, seek_bits, backseek_nbyte, len(data) + 10) == data
+            assert decompress(compressed, seek_bits, backseek_nbyte, max(len(data) - 1, 0)) == data
+            for limit in {1, 3, len(data) // 3, len(data)} - {0}:
+                assert decompress(compressed, seek_bits, backseek_nbyte, out_limit=limit) == data[:limit]
+                assert decompress(compressed, seek_bits, backseek_nbyte, len(data), limit) == data[:limit]
+
+def test_levels_compress_better():
+    # more effort never loses much on the same input, and all levels compress runs
+    data = b''.join(bytes([i % 7]) * (i % 13 + 1) for i in range(2000))
+    for seek_bits, backseek_nbyte in TEST_PARAMS:
+        sizes = [len(compress(data, seek_bits, backseek_nbyte, level)) for level in CompressLevel]
+        assert max(sizes) < len(data) // 2, sizes
+        assert sizes[CompressLevel.Deep] <= sizes[CompressLevel.Greedy], sizes
+
+if __name__ == "__main__":
+    test_known_streams()
+    test_roundtrip()
+    test_out_size_and_limit()
+    test_levels_compress_better()
+    print("test pass")
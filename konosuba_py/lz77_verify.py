@@ -0,0 +1,133 @@
+import sys
+import json
+import time
+import argparse
+from typing import Dict, List, Optional
+
+import lz77
+from fnt4_extract import Font, LZ77_PARAMS, pool_map
+from benchmark import SAMPLE_FONTS
+
+"""
+Round-trip verification of the lz77 codec over fonts:
+every glyph is decompressed from the original stream, compressed again and the result decompressed,
+a glyph fails if the original stream doesn't decode to its uncompressed size, or the new stream doesn't decode identically.
+Chunks of glyphs are verified in a process pool, reports failures, compressed size against the original streams and throughput.
+
+python lz77_verify.py [font ...] [--level lazy] [--workers N] [--json report.json]
+exit code is 1 if any glyph fails
+"""
+
+# Font of path in this (worker) process
+_VERIFY_FONTS: Dict[str, Font] = {}
+
+
+def verify_glyph(font: Font, glyph_id: int, level: lz77.CompressLevel) -> Dict:
+    """round-trip of one glyph, original_size is the stored size (uncompressed size if stored uncompressed)"""
+    seek_bits, backseek_nbyte = LZ77_PARAMS[font.version]
+    glyph_data = font.glyphs[glyph_id].glyph_data
+    result = {'glyph_id': glyph_id, 'uncompressed_size': glyph_data.uncompressed_size,
+              'original_size': len(glyph_data.data), 'new_size': 0, 'identical': False, 'error': None}
+    try:
+        data = glyph_data.decompress(seek_bits, backseek_nbyte)
+        if len(data) != glyph_data.uncompressed_size:
+            result['error'] = f"original stream decodes to {len(data)} bytes, expect {glyph_data.uncompressed_size}"
+            return result
+        compressed = lz77.compress(data, seek_bits, backseek_nbyte, level)
+        result['new_size'] = len(compressed)
+        result['identical'] = glyph_data.is_compressed and compressed == bytes(glyph_data.data)
+        decompressed = lz77.decompress(compressed, seek_bits, backseek_nbyte, len(data))
+        if decompressed != data:
+            mismatch = next((i for i, (a, b) in enumerate(zip(decompressed, data)) if a != b), min(len(decompressed), len(data)))
+            result['error'] = f"round-trip differs at byte {mismatch} ({len(decompressed)} of {len(data)} bytes decoded)"
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def _verify_chunk(job) -> List[Dict]:
+    # job: (font_path, glyph_ids, level), reopen the font in worker instead of pickling it
+    font_path, glyph_ids, level = job
+    font = _VERIFY_FONTS.get(font_path)
+    if font is None:
+        font = _VERIFY_FONTS[font_path] = Font.open(font_path)
+    return [verify_glyph(font, glyph_id, level) for glyph_id in glyph_ids]
+
+
+def summarize(results: List[Dict], seconds: float, top: int) -> Dict:
+    verified = [r for r in results if r['error'] is None]
+    uncompressed_bytes = sum(r['uncompressed_size'] for r in results)
+    original_bytes = sum(r['original_size'] for r in verified)
+    new_bytes = sum(r['new_size'] for r in verified)
+    # glyphs which grow most against the original stream
+    worst = sorted(verified, key=lambda r: r['new_size'] - r['original_size'], reverse=True)[:top]
+    return {
+        'glyphs': len(results),
+        'failures': [{'glyph_id': r['glyph_id'], 'error': r['error']} for r in results if r['error'] is not None],
+        'identical_streams': sum(1 for r in verified if r['identical']),
+        'uncompressed_bytes': uncompressed_bytes,
+        'original_bytes': original_bytes,
+        'new_bytes': new_bytes,
+        'original_ratio': original_bytes / uncompressed_bytes if uncompressed_bytes else 0.0,
+        'new_ratio': new_bytes / uncompressed_bytes if uncompressed_bytes else 0.0,
+        'ratio_delta': (new_bytes - original_bytes) / original_bytes if original_bytes else 0.0,
+        'worst': [{'glyph_id': r['glyph_id'], 'original_size': r['original_size'], 'new_size': r['new_size']}
+                  for r in worst if r['new_size'] > r['original_size']],
+        'seconds': seconds,
+        'mb_per_sec': uncompressed_bytes / seconds / 1e6 if seconds else 0.0,
+        'glyphs_per_sec': len(results) / seconds if seconds else 0.0,
+    }
+
+
+def verify_fonts(font_paths: List[str], level=lz77.CompressLevel.Lazy, workers: Optional[int]=None,
+                 chunk_size: int=256, top: int=10) -> Dict[str, Dict]:
+    """round-trip every glyph of the fonts in one process pool, return summarize() of every font path"""
+    jobs = []
+    for font_path in font_paths:
+        glyph_ids = sorted(Font.open(font_path).glyphs.keys())
+        jobs += [(font_path, glyph_ids[i:i+chunk_size], level) for i in range(0, len(glyph_ids), chunk_size)]
+    start = time.perf_counter()
+    chunks = pool_map(_verify_chunk, jobs, workers)
+    seconds = time.perf_counter() - start
+    _VERIFY_FONTS.clear()
+
+    results: Dict[str, List[Dict]] = {font_path: [] for font_path in font_paths}
+    for (font_path, _, _), chunk in zip(jobs, chunks):
+        results[font_path] += chunk
+    # the pool runs all fonts at once, time of a font is its share of the uncompressed bytes
+    total_bytes = sum(r['uncompressed_size'] for chunk in chunks for r in chunk) or 1
+    return {font_path: summarize(font_results, seconds * sum(r['uncompressed_size'] for r in font_results) / total_bytes, top)
+            for font_path, font_results in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="verify lz77 compress/decompress round-trip over every glyph of fonts")
+    parser.add_argument('fonts', nargs='*', default=SAMPLE_FONTS, help="fnt(FNT4) files, default the sample fonts")
+    parser.add_argument('--level', default='lazy', choices=[level.name.lower() for level in lz77.CompressLevel],
+                        help="lz77 compress level")
+    parser.add_argument('--workers', type=int, default=None, help="processes, default cpu count")
+    parser.add_argument('--chunk-size', type=int, default=256, help="glyphs of a job")
+    parser.add_argument('--top', type=int, default=10, help="report the glyphs growing most against the original stream")
+    parser.add_argument('--json', help="write the report json here")
+    args = parser.parse_args()
+
+    level = lz77.CompressLevel[args.level.capitalize()]
+    report = verify_fonts(args.fonts, level, args.workers, args.chunk_size, args.top)
+    failed = 0
+    for font_path, summary in report.items():
+        failed += len(summary['failures'])
+        print(f"{font_path}: {summary['glyphs']} glyphs, {len(summary['failures'])} failures, "
+              f"{summary['identical_streams']} identical streams")
+        print(f"  ratio {summary['original_ratio']:.4f} -> {summary['new_ratio']:.4f} ({summary['ratio_delta']:+.2%}), "
+              f"{summary['mb_per_sec']:.2f} MB/s, {summary['glyphs_per_sec']:.1f} glyphs/s")
+        for failure in summary['failures'][:args.top]:
+            print(f"  FAIL glyph {failure['glyph_id']}: {failure['error']}")
+        for worst in summary['worst']:
+            print(f"  grow glyph {worst['glyph_id']}: {worst['original_size']} -> {worst['new_size']} bytes")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import argparse
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+
+import fnt4_extract
+from fnt4_extract import Font, GlyphData, GlyphHeader, GlyphInfo, GlyphStore, LazyGlyph
+
+"""
+Text measurement and line breaking with FNT4 font metrics,
+e.g. check that every translated scenario line fits the text box.
+
+Width of a text is the sum of advance_width of its glyphs (no kerning),
+measure/check work on many texts at once with the per-character advance array.
+"""
+
+# characters that a line can break after (besides any CJK character)
+BREAK_AFTER = ' \t'
+# code of newline in TextLayout._batch, not a missing character
+NEWLINE = -2
+
+
+@dataclass
+class Overflow:
+    line: int  # index of the text in the checked texts
+    column: int  # index of the character in the text where the problem starts
+    kind: str  # 'height': more lines than box, 'width': a glyph is wider than box, 'missing': no glyph for character
+    lines: int = 0  # lines after breaking the text
+
+
+class TextLayout:
+    def __init__(self, font: Font):
+        self.font = font
+        self.line_height = font.get_line_height()
+        characters = np.asarray(font.get_character_mapping(), dtype=np.int64)
+        # the read glyph table only while no glyph is replaced (Font.patch/dedup), else the metrics of font.glyphs
+        if font.glyph_table is not None and isinstance(font.glyphs, GlyphStore) and not font.glyphs.modified():
+            glyph_advances = font.glyph_table.advance_width.astype(np.int32)
+        else:
+            glyph_advances = np.zeros(max(font.glyphs.keys(), default=-1) + 1, dtype=np.int32)
+            for glyph_id, glyph in font.glyphs.items():
+                glyph_advances[glyph_id] = glyph.info.advance_width
+        # advance_width of every character code in font
+        self.advances = glyph_advances[characters] if len(characters) else np.zeros(0, dtype=np.int32)
+
+    def codes(self, text: str) -> np.ndarray:
+        """character codes of font (unicode in FNT4 v1, index of CP932 table in FNT4 v0), -1 if not in font"""
+        if self.font.version==0:
+            codes = fnt4_extract.unicode_to_codes(text)
+        else:
+            codes = np.frombuffer(text.encode('utf-32-le'), dtype='<u4').astype(np.int64)
+        codes[codes >= len(self.advances)] = -1
+        return codes
+
+    def text_advances(self, text: str) -> np.ndarray:
+        codes = self.codes(text)
+        return np.where(codes >= 0, self.advances[np.maximum(codes, 0)], 0)
+
+    def _batch(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # codes of all texts joined, start of every text in codes, width of every text
+        lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+        starts = np.cumsum(lengths) - lengths
+        joined = ''.join(texts)
+        codes = self.codes(joined)
+        codes[np.frombuffer(joined.encode('utf-32-le'), dtype='<u4') == ord('\n')] = NEWLINE
+        advances = np.where(codes >= 0, self.advances[np.maximum(codes, 0)], 0).astype(np.int64)
+        cumsum = np.concatenate([[0], np.cumsum(advances)])
+        return codes, starts, cumsum[starts + lengths] - cumsum[starts]
+
+    def measure(self, texts: List[str]) -> np.ndarray:
+        """width of every text (without line breaking, newline has no width)"""
+        return self._batch(texts)[2]
+
+    def break_lines(self, text: str, max_width: int) -> List[Tuple[int, int]]:
+        """
+        break text into lines not wider than max_width, return [start, end) of every line.
+        newline always breaks, otherwise prefer to break after a space, or anywhere if a word is too long
+        (CJK text has no spaces). a glyph wider than max_width still takes a line
+        """
+        advances = self.text_advances(text).astype(np.int64)
+        lines = []
+        paragraph_start = 0
+        for paragraph in text.split('\n'):
+            paragraph_end = paragraph_start + len(paragraph)
+            cumsum = np.cumsum(advances[paragraph_start:paragraph_end])
+            start = 0
+            while True:
+                limit = (cumsum[start-1] if start else 0) + max_width
+                end = int(np.searchsorted(cumsum, limit, side='right'))
+                if end >= len(paragraph):
+                    lines.append((paragraph_start + start, paragraph_end))
+                    break
+                end = max(end, start + 1)  # a glyph wider than max_width still takes a line
+                if end >= len(paragraph):
+                    lines.append((paragraph_start + start, paragraph_end))
+                    break
+                next_start = end
+                if paragraph[end] in BREAK_AFTER:
+                    next_start = end + 1  # the space which doesn't fit is dropped
+                else:
+                    space = max(paragraph.rfind(c, start, end) for c in BREAK_AFTER)
+                    if space >= start:
+                        end = next_start = space + 1
+                lines.append((paragraph_start + start, paragraph_start + end))
+                start = next_start
+                if start >= len(paragraph):
+                    break
+            paragraph_start = paragraph_end + 1
+        return lines
+
+    def check(self, texts: List[str], box_width: int, box_height: int) -> List[Overflow]:
+        """
+        find texts which don't fit in a box_width x box_height text box,
+        vertical fit is counted in lines of get_line_height().
+        texts are measured all at once, only those wider than the box or with a newline are broken into lines
+        """
+        max_lines = box_height // self.line_height if self.line_height else 0
+        codes, starts, widths = self._batch(texts)
+        overflows = []
+        missing = np.flatnonzero(codes == -1)
+        missing_lines = np.searchsorted(starts, missing, side='right') - 1
+        for line, position in zip(missing_lines.tolist(), missing.tolist()):
+            overflows.append(Overflow(line, position - starts[line].item(), 'missing'))
+
+        need_break = widths > box_width
+        need_break |= np.fromiter(('\n' in text for text in texts), dtype=bool, count=len(texts))  # forced newline
+        if max_lines < 1:
+            need_break |= widths > 0
+        for line in np.flatnonzero(need_break).tolist():
+            text = texts[line]
+            advances = self.text_advances(text)
+            for column in np.flatnonzero(advances > box_width).tolist():
+                overflows.append(Overflow(line, column, 'width'))
+            lines = self.break_lines(text, box_width)
+            if len(lines) > max_lines:
+                overflows.append(Overflow(line, lines[max_lines][0] if max_lines else 0, 'height', len(lines)))
+        overflows.sort(key=lambda overflow: (overflow.line, overflow.column))
+        return overflows
+
+
+def _test_layout(advances: dict) -> TextLayout:
+    # FNT4 v1 font of only metrics, advances: char: advance_width, other characters use glyph 0
+    glyphs = {}
+    characters = [0] * 0x80
+    for glyph_id, (char, advance_width) in enumerate(advances.items()):
+        header = GlyphHeader(None)
+        header.bearing_x = header.bearing_y = header.actual_width = header.actual_height = 0
+        header.advance_width = advance_width
+        info = GlyphInfo(header=header, fnt_version=1, chara_index=ord(char))
+        glyphs[glyph_id] = LazyGlyph(info, (1, 1), GlyphData(b'', False, 0))
+        characters[ord(char)] = glyph_id
+    return TextLayout(Font(1, 8, 2, b'', 0, characters, glyphs))
+
+def test_break_lines():
+    layout = _test_layout({' ': 2, 'i': 2, 'a': 4, 'W': 6, 'h': 4, 'e': 4, 'l': 2, 'o': 4})
+    assert layout.break_lines('aa aa', 10) == [(0, 3), (3, 5)]
+    assert layout.break_lines('a\naa', 10) == [(0, 1), (2, 4)]
+    # a glyph wider than the box takes a line, also at the end of a paragraph
+    assert layout.break_lines('iW', 5) == [(0, 1), (1, 2)]
+    assert layout.break_lines('W', 5) == [(0, 1)]
+    assert layout.break_lines('a\nW', 5) == [(0, 1), (2, 3)]
+    assert layout.break_lines('hello', 0) == [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)]
+
+def test_check_wide_glyph():
+    layout = _test_layout({'i': 2, 'W': 6})
+    assert layout.check(['iW'], 5, 100) == [Overflow(0, 1, 'width')]
+    overflows = layout.check(['iW', 'W'], 5, 10)
+    assert overflows == [Overflow(0, 1, 'width'), Overflow(0, 1, 'height', 2), Overflow(1, 0, 'width')], overflows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="check that every line of a script fits the text box")
+    parser.add_argument('font_path', help="fnt(FNT4) file path")
+    parser.add_argument('script_path', help="utf-8 text file, one scenario line per line, '\\n' for a forced newline")
+    parser.add_argument('--width', type=int, required=True, help="text box width in pixels")
+    parser.add_argument('--height', type=int, required=True, help="text box height in pixels")
+    args = parser.parse_args()
+
+    layout = TextLayout(Font.open(args.font_path))
+    with open(args.script_path, encoding='utf-8') as f:
+        texts = [line.rstrip('\n').replace('\\n', '\n') for line in f]
+    overflows = layout.check(texts, args.width, args.height)
+    for overflow in overflows:
+        print(f"{overflow.line+1}:{overflow.column+1}: {overflow.kind}"
+              + (f" ({overflow.lines} lines)" if overflow.kind == 'height' else ""))
+    print(f"{len(texts)} lines, {len(overflows)} overflows")
+
+if __name__ == '__main__':
+    main()
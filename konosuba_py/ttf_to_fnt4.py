@@ -0,0 +1,159 @@
+import time
+import argparse
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+import lz77
+from fnt4_extract import (Font, GlyphData, GlyphHeader, GlyphInfo, LazyGlyph, LZ77_PARAMS,
+                          encode_bitmaps, glyph_digest, pool_map, stored_glyph_data, unicode_to_codes)
+
+"""
+Generate FNT4 fonts from a TTF/OTF font, e.g. the characters a translation needs.
+
+Glyphs are rasterized with PIL (FreeType) in a process pool, every worker takes a chunk of characters:
+rasterize -> pad to power of 2 textures and build the mip levels of the chunk at once (FNT4 v1) / pack 4bpp (FNT4 v0)
+-> lz77 compress, so the font is packed without compressing again.
+Glyphs with the same bitmap and metrics share one glyph record: the workers hash every glyph (glyph_digest, same as
+Font.dedup) before compressing it, so duplicates (e.g. the missing glyph box of thousands of characters) are compressed
+once, Font.dedup after building would compress them all and decompress them again.
+
+python ttf_to_fnt4.py font.ttf output.fnt --size 24 [--chars script.txt] [--range 0x20 0x7f] [--version 1]
+"""
+
+# entries of the FNT4 v0 characters table in the shipped fonts (11440): single byte sjis
+# and 188 trail bytes of every lead byte 0x81-0x9F, 0xE0-0xFC, longer than CP932_SJIS which ends at lead byte 0xEE
+V0_CHARACTER_SIZE = 0xA0 + ((0x9F-0x81+1) + (0xFC-0xE0+1)) * 188
+
+# FreeTypeFont of (path, size) in this (worker) process
+_TTF_FONTS: Dict[Tuple[str, int], ImageFont.FreeTypeFont] = {}
+
+
+def load_ttf(path: str, size: int) -> ImageFont.FreeTypeFont:
+    key = (path, size)
+    if key not in _TTF_FONTS:
+        _TTF_FONTS[key] = ImageFont.truetype(path, size)
+    return _TTF_FONTS[key]
+
+
+def rasterize(ttf: ImageFont.FreeTypeFont, char: str) -> Tuple[np.ndarray, int, int, int]:
+    """
+    [height, width] u8 bitmap of char without padding, and the metrics as GlyphInfo:
+    bearing_x (pen position to the left of bitmap), bearing_y (baseline to the top of bitmap), advance_width
+    """
+    left, top, right, bottom = ttf.getbbox(char, anchor='ls')  # from the pen at baseline, y goes down
+    advance_width = round(ttf.getlength(char))
+    if right <= left or bottom <= top:  # blank, e.g. space, 1x1 zero bitmap like the shipped fonts
+        return np.zeros([1, 1], dtype=np.uint8), 0, 0, advance_width
+    image = Image.new('L', (right - left, bottom - top))
+    ImageDraw.Draw(image).text((-left, -top), char, font=ttf, fill=255, anchor='ls')
+    return np.asarray(image), left, -top, advance_width
+
+
+def _build_glyphs_chunk(job) -> List[tuple]:
+    """
+    job: (ttf_path, size, [(character code, char)], fnt_version, level), module level for pickling to worker process.
+    return (code, metrics, texture_size, data, is_compressed, uncompressed_size, digest) of every character,
+    metrics: (bearing_x, bearing_y, actual_width, actual_height, advance_width), digest: glyph_digest
+    """
+    ttf_path, size, chars, fnt_version, level = job
+    ttf = load_ttf(ttf_path, size)
+    rasters = [rasterize(ttf, char) for _, char in chars]
+    encoded = encode_bitmaps([bitmap for bitmap, *_ in rasters], fnt_version)
+    seek_bits, backseek_nbyte = LZ77_PARAMS[fnt_version]
+    results = []
+    stored = {}  # digest: (data, is_compressed), duplicates in chunk (e.g. missing glyph box) are compressed once
+    for (code, char), (bitmap, bearing_x, bearing_y, advance_width), (data, texture_size) in zip(chars, rasters, encoded):
+        if not (-0x80 <= bearing_x < 0x80 and -0x80 <= bearing_y < 0x80 and advance_width <= 0xFF):
+            raise ValueError(f"metrics of {char!r} out of FNT4 range: {bearing_x}, {bearing_y}, {advance_width}")
+        metrics = (bearing_x, bearing_y, bitmap.shape[1], bitmap.shape[0], advance_width)
+        digest = glyph_digest((*metrics, tuple(texture_size)), data)
+        if digest not in stored:
+            stored_data, compressed_size = stored_glyph_data(data, lz77.compress(data, seek_bits, backseek_nbyte, level))
+            stored[digest] = (stored_data, compressed_size > 0)
+        results.append((code, metrics, texture_size, *stored[digest], len(data), digest))
+    return results
+
+
+def build_font(ttf_path: str, size: int, chars: str, fnt_version=1, fallback: str = ' ',
+               workers: Optional[int]=None, level=lz77.CompressLevel.Lazy, chunk_size: int = 256) -> Font:
+    """
+    FNT4 font of chars rasterized from ttf_path at size (pixels per em), ascent/descent from the ttf.
+    characters not in chars use the glyph of fallback.
+    FNT4 v1 characters table is indexed by unicode (chars out of BMP are skipped),
+    FNT4 v0 by CP932 table (chars not in cp932 are skipped)
+    """
+    ttf = load_ttf(ttf_path, size)
+    ascent, descent = ttf.getmetrics()
+    chars = ''.join(dict.fromkeys(fallback + chars))
+    if fnt_version==1:
+        codes = [ord(char) if ord(char) < 0x10000 else -1 for char in chars]
+    else:
+        codes = unicode_to_codes(chars).tolist()
+    table_name = "BMP" if fnt_version==1 else "CP932 table"
+    coded = [(code, char) for code, char in zip(codes, chars) if code >= 0]
+    if not coded or coded[0][1] != chars[0]:
+        raise ValueError(f"fallback {fallback!r} not in {table_name}")
+    if len(coded) < len(chars):
+        print(f"skip {len(chars) - len(coded)} characters not in {table_name}")
+    jobs = [(ttf_path, size, coded[i:i+chunk_size], fnt_version, level) for i in range(0, len(coded), chunk_size)]
+
+    glyphs: Dict[int, LazyGlyph] = {}
+    glyph_ids: Dict[bytes, int] = {}  # digest: glyph_id, duplicate glyphs share one
+    code_glyphs: Dict[int, int] = {}  # character code: glyph_id
+    for chunk in pool_map(_build_glyphs_chunk, jobs, workers):
+        for code, metrics, texture_size, data, is_compressed, uncompressed_size, digest in chunk:
+            glyph_id = glyph_ids.get(digest)
+            if glyph_id is None:
+                glyph_id = glyph_ids[digest] = len(glyphs)
+                header = GlyphHeader(None, fnt_version=fnt_version)
+                header.bearing_x, header.bearing_y, header.actual_width, header.actual_height, header.advance_width = metrics
+                if fnt_version==1:
+                    header.texture_width, header.texture_height = texture_size
+                info = GlyphInfo(header=header, fnt_version=fnt_version, chara_index=code)
+                glyphs[glyph_id] = LazyGlyph(info, texture_size, GlyphData(data, is_compressed, uncompressed_size))
+            code_glyphs[code] = glyph_id
+
+    # v1 table is indexed by BMP code point, always 0x10000 entries, v0 is padded to the shipped layout
+    character_size = 0x10000 if fnt_version==1 else V0_CHARACTER_SIZE
+    characters = array('I', [code_glyphs[coded[0][0]]]) * character_size  # fallback
+    for code, glyph_id in code_glyphs.items():
+        characters[code] = glyph_id
+    return Font(fnt_version, ascent, descent, b'', 0, characters, glyphs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate FNT4 font from TTF/OTF font")
+    parser.add_argument('ttf_path', help="ttf/otf file path")
+    parser.add_argument('output_path', help="fnt(FNT4) output path")
+    parser.add_argument('--size', type=int, required=True, help="font size in pixels")
+    parser.add_argument('--chars', help="utf-8 text file, all characters in it are generated")
+    parser.add_argument('--range', type=lambda v: int(v, 0), nargs=2, action='append', metavar=('START', 'END'),
+                        help="generate unicode [START, END), can be repeated, default printable ascii if no --chars")
+    parser.add_argument('--version', type=int, default=1, choices=[0, 1], help="FNT4 version")
+    parser.add_argument('--fallback', default=' ', help="character used for characters not generated")
+    parser.add_argument('--workers', type=int, default=None, help="processes, default cpu count")
+    parser.add_argument('--level', default='lazy', choices=[level.name.lower() for level in lz77.CompressLevel],
+                        help="lz77 compress level")
+    args = parser.parse_args()
+
+    chars = ''
+    if args.chars:
+        with open(args.chars, encoding='utf-8') as f:
+            chars += ''.join(char for char in f.read() if char.isprintable())
+    for start, end in args.range or ([] if args.chars else [(0x20, 0x7F)]):
+        chars += ''.join(map(chr, range(start, end)))
+    level = lz77.CompressLevel[args.level.capitalize()]
+
+    start = time.perf_counter()
+    font = build_font(args.ttf_path, args.size, chars, args.version, args.fallback, args.workers, level)
+    data = font.to_bytes(args.workers, level)
+    with open(args.output_path, 'wb') as f:
+        f.write(data)
+    print(f"{len(set(chars))} characters, {len(font.glyphs)} glyphs, {len(data)} bytes "
+          f"in {time.perf_counter() - start:.2f}s")
+
+if __name__ == '__main__':
+    main()